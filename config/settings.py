@@ -48,16 +48,21 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.SamplingProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'store.middleware.BrowserSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'store.middleware.BrowserCsrfViewMiddleware',
+    'store.middleware.BrowserAuthenticationMiddleware',
+    'store.middleware.BrowserMessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'store.middleware.BrowserDebugToolbarMiddleware',
+    'store.middleware.PrimaryPinMiddleware',
 ]
 
+# requests under these paths skip the Browser* middleware above (session, CSRF, auth, messages, toolbar)
+API_PATH_PREFIXES = ['/store/', '/auth/']
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
@@ -96,6 +101,26 @@ DATABASES = {
     }
 }
 
+# Read-only catalog views (products, categories, comments) read from these aliases.
+# Add them to DATABASES with the same schema, e.g. for a local setup:
+#   'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'primary.sqlite3'},
+#   'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'replica.sqlite3',
+#               'TEST': {'MIRROR': 'default'}},
+DATABASE_REPLICAS = []
+
+DATABASE_ROUTERS = ['store.replicas.PrimaryReplicaRouter']
+
+# Rate and catalog versions, cached responses, primary pins and THROTTLE_STORAGE = 'cache' live here.
+# Every worker has to share it outside DEBUG (check store.W001), e.g.
+#   'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'},
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+# seconds a user keeps reading from the primary after a write. A signed cookie carries the pin
+# between workers; the per-user pin for JWT clients without cookies needs a shared CACHES backend
+PRIMARY_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -145,9 +170,68 @@ REST_FRAMEWORK = {
     'PAGE_SIZE':10,
     'DEFAULT_AUTHENTICATION_CLASSES':(
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    'DEFAULT_RENDERER_CLASSES':(
+        'store.renderers.FastJSONRenderer',
+        'store.renderers.NDJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES':(
+        'store.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_THROTTLE_RATES':{
+        'cart':'120/min',
+        'checkout':'10/min',
+    },
 }
 
+# 'memory' keeps throttle state per process, 'cache' shares it between workers through CACHES
+THROTTLE_STORAGE = 'memory'
+
+# in-flight checkouts above this get a 503 with Retry-After
+CHECKOUT_CONCURRENCY_LIMIT = 20
+
+# raise when a nested serializer runs a per-row query instead of going through store.loaders
+RELATION_LOADER_STRICT = False
+
+# fraction of requests profiled by SamplingProfilerMiddleware, 0 disables it
+PROFILE_SAMPLE_RATE = 0
+# 'sample' records collapsed stacks every PROFILE_SAMPLE_INTERVAL seconds, 'cprofile' records pstats
+PROFILE_MODE = 'sample'
+PROFILE_SAMPLE_INTERVAL = 0.005
+# each endpoint's aggregate is written to PROFILE_DIR and reset after this many sampled requests
+PROFILE_FLUSH_REQUESTS = 100
+PROFILE_DIR = BASE_DIR / 'profiles'
+
+# change feed entries younger than this are held back so concurrent inserts committing out of id order
+# are not skipped by the cursor, entries are written after their transaction commits
+CHANGE_FEED_SETTLE_SECONDS = 2
+
+# clear_catalog_changes deletes change feed entries older than this
+CATALOG_CHANGES_RETENTION = timedelta(days=30)
+
+# paid and canceled orders older than this are moved to the archive tables by archive_orders
+ORDER_ARCHIVE_AFTER = timedelta(days=365)
+
+# send_queued_emails gives up on a message after this many failed attempts
+MAIL_QUEUE_MAX_ATTEMPTS = 5
+# messages per second send_queued_emails sends at most
+MAIL_QUEUE_RATE = 10
+
+# product and category list/detail responses are cached this long, any catalog change invalidates them
+RESPONSE_CACHE_SECONDS = 300
+
+# id lists behind product list pages, invalidated per category by product and category changes
+QUERY_CACHE_SECONDS = 600
+
+# neighbors kept per product by build_recommendations
+RECOMMENDATIONS_TOP_K = 10
+
+# checkout retries carrying the same Idempotency-Key within this window get the stored response
+IDEMPOTENCY_KEY_WINDOW = timedelta(hours=24)
+
 
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
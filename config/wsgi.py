@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# load the autocomplete index in the background so the first search doesn't wait for it
+from store import autocomplete
+
+autocomplete.warm_up()
@@ -1,15 +1,21 @@
+from django import forms
 from django.contrib import admin, messages
+from django.db import transaction
+from django.template.response import TemplateResponse
 from django.db.models import Count
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.http import urlencode
 
 from . import models
+from . import bulk_edit
+from . import inventory
+from . import serializers
 
 
 class OrderItemInline(admin.TabularInline):
     model = models.OrderItem
-    fields = ['product', 'quantity', 'unit_price']
+    fields = ['product', 'quantity', 'unit_price', 'discount']
     extra = 1
 
 
@@ -35,6 +41,25 @@ class InventoryFilter(admin.SimpleListFilter):
         if self.value() == InventoryFilter.MORE_THAN_10:
             return queryset.filter(inventory__gt=10)
 
+class ProductBulkEditForm(forms.Form):
+    field = forms.ChoiceField(choices=[('unit_price','Unit price'),('inventory','Inventory')])
+    mode = forms.ChoiceField(choices=[(mode,mode) for mode in bulk_edit.MODES])
+    value = forms.DecimalField(required=False,decimal_places=2)
+    price_list = forms.CharField(
+        widget=forms.Textarea,
+        required=False,
+        help_text='One "id,unit_price,inventory" per line, either value may be empty. Applied instead of the adjustment.',
+    )
+    
+    def serializer_data(self,queryset):
+        if self.cleaned_data['price_list'].strip():
+            return {'price_list': bulk_edit.parse_price_list(self.cleaned_data['price_list'])}
+        return {
+            'products': list(queryset.values_list('id',flat=True)),
+            self.cleaned_data['field']: {'mode': self.cleaned_data['mode'],'value': self.cleaned_data['value']},
+        }
+
+
 @admin.register(models.Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['id', 'name', 'inventory','inventory_status','category','product_category', 'unit_price', 'num_of_comments', 'product_category']
@@ -42,7 +67,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_editable = ['unit_price']
     list_select_related = ['category']
     list_filter = ['datetime_created', InventoryFilter, 'category']
-    actions = ['clear_inventory']
+    actions = ['clear_inventory', 'bulk_edit_prices']
     search_fields = ['name',]
     exclude = ['discounts',]
     readonly_fields = ['category']
@@ -52,13 +77,38 @@ class ProductAdmin(admin.ModelAdmin):
     
     @admin.action(description='clear inventory')
     def clear_inventory(self,request,queryset):
-        update_clear = queryset.update(inventory=0)
+        product_ids = list(queryset.values_list('id',flat=True))
+        with transaction.atomic():
+            # stock in counter rows would otherwise survive the clear
+            inventory.fold_shards(product_ids)
+            update_clear = models.Product.objects.filter(id__in=product_ids).update(inventory=0)
+            inventory.announce(product_ids)
         self.message_user(
             request,
             f'{update_clear} of products inventories cleaned to zero',
             messages.WARNING,
         )
     
+    @admin.action(description='bulk edit price / inventory')
+    def bulk_edit_prices(self,request,queryset):
+        form = ProductBulkEditForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            serializer = serializers.ProductBulkEditSerializer(data=form.serializer_data(queryset))
+            if serializer.is_valid():
+                updated = serializer.save()
+                self.message_user(request,f'{updated} products updated',messages.SUCCESS)
+                return None
+            form.add_error(None,str(serializer.errors))
+        
+        return TemplateResponse(request,'admin/store/product/bulk_edit.html',{
+            **self.admin_site.each_context(request),
+            'title': 'Bulk edit price / inventory',
+            'opts': self.model._meta,
+            'form': form,
+            'products': queryset,
+            'action_checkbox_name': admin.helpers.ACTION_CHECKBOX_NAME,
+        })
+    
     def inventory_status(self,product:models.Product):
         if product.inventory < 10 :
             return 'Low'
@@ -92,18 +142,42 @@ class ProductAdmin(admin.ModelAdmin):
     
 @admin.register(models.Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'customer', 'status','num_of_items', 'datetime_created']
+    list_display = ['id', 'customer', 'status','item_count', 'total', 'datetime_created']
     list_editable = ['status']
     list_per_page = 10
     ordering = ['datetime_created']
     inlines = [OrderItemInline]
+    readonly_fields = models.Order.TOTAL_FIELDS
+    actions = ['mark_paid', 'mark_canceled']
     
-    def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('items').annotate(items_count=Count('items'))
+    def _bulk_transition(self, request, queryset, status):
+        results = models.Order.objects.bulk_transition(
+            {order_id: status for order_id in queryset.values_list('id', flat=True)}
+        )
+        failed = [order_id for order_id, result in results.items() if result['error']]
+        self.message_user(
+            request,
+            f'{len(results) - len(failed)} orders updated',
+            messages.SUCCESS,
+        )
+        if failed:
+            self.message_user(
+                request,
+                f'{len(failed)} orders skipped, their status cannot change that way: {failed}',
+                messages.WARNING,
+            )
+    
+    @admin.action(description='mark as paid')
+    def mark_paid(self, request, queryset):
+        self._bulk_transition(request, queryset, models.Order.ORDER_STATUS_PAID)
+    
+    @admin.action(description='mark as canceled')
+    def mark_canceled(self, request, queryset):
+        self._bulk_transition(request, queryset, models.Order.ORDER_STATUS_CANCELED)
     
-    @admin.display(ordering='items_count')
-    def num_of_items(self,order:models.Order):
-        return order.items_count
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.update_totals()
     
     
 @admin.register(models.Comment)
@@ -132,11 +206,35 @@ class CustomerAdmin(admin.ModelAdmin):
     def email(self,customer:models.Customer):
         return customer.email
     
+@admin.register(models.Rate)
+class RateAdmin(admin.ModelAdmin):
+    list_display = ['code', 'kind', 'value', 'datetime_modified']
+    list_editable = ['value']
+    list_filter = ['kind']
+    
+    
 @admin.register(models.OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ['order', 'product', 'quantity', 'unit_price']
+    list_display = ['order', 'product', 'quantity', 'unit_price', 'discount']
     autocomplete_fields = ['product',]
     
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # the item may have moved to another order
+        if 'order' in form.changed_data and form.initial.get('order'):
+            models.Order.objects.get(pk=form.initial['order']).update_totals()
+        obj.order.update_totals()
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        obj.order.update_totals()
+    
+    def delete_queryset(self, request, queryset):
+        order_ids = set(queryset.values_list('order_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for order in models.Order.objects.filter(id__in=order_ids):
+            order.update_totals()
+    
     
 class CartItemInline(admin.TabularInline):
     model = models.CartItem
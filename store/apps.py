@@ -8,3 +8,4 @@ class StoreConfig(AppConfig):
     def ready(self):
         
         import store.signals.handlers
+        import store.checks
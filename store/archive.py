@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from . import models
+
+
+ARCHIVABLE_STATUSES = [models.Order.ORDER_STATUS_PAID, models.Order.ORDER_STATUS_CANCELED]
+
+
+def get_archive_after():
+    return settings.ORDER_ARCHIVE_AFTER
+
+
+def get_horizon():
+    '''Orders created before this may live in the archive tables.'''
+    return timezone.now() - get_archive_after()
+
+
+def archived_orders():
+    return models.ArchivedOrder.objects.prefetch_related(
+        Prefetch('items', queryset=models.ArchivedOrderItem.objects.select_related('product'))
+    ).select_related('customer__user')
+
+
+def archive_batch(cutoff, batch_size):
+    '''
+    Moves up to `batch_size` paid or canceled orders created before `cutoff`, with their items,
+    in one short transaction. Rows locked by a concurrent writer are skipped until the next batch.
+    '''
+    with transaction.atomic():
+        orders = list(
+            models.Order.objects
+            .filter(datetime_created__lt=cutoff, status__in=ARCHIVABLE_STATUSES)
+            .order_by('id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not orders:
+            return 0
+
+        order_ids = [order.id for order in orders]
+        items = models.OrderItem.objects.filter(order_id__in=order_ids)
+
+        models.ArchivedOrder.objects.bulk_create([
+            models.ArchivedOrder(
+                id=order.id,
+                customer_id=order.customer_id,
+                status=order.status,
+                datetime_created=order.datetime_created,
+                item_count=order.item_count,
+                subtotal=order.subtotal,
+                discount=order.discount,
+                total=order.total,
+            )
+            for order in orders
+        ])
+        models.ArchivedOrderItem.objects.bulk_create([
+            models.ArchivedOrderItem(
+                id=item.id,
+                order_id=item.order_id,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                unit_price=item.unit_price,
+                discount=item.discount,
+            )
+            for item in items
+        ])
+        items.delete()
+        models.Order.objects.filter(id__in=order_ids).delete()
+
+    return len(orders)
@@ -0,0 +1,151 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from . import models
+from . import serializers
+from . import renderers
+from . import rates
+from . import inventory
+
+
+USER = get_user_model()
+
+PAGE_SIZE = settings.REST_FRAMEWORK['PAGE_SIZE']
+
+
+def json_response(data, status=200):
+    return HttpResponse(renderers.FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def not_found():
+    return json_response({'detail': 'Not found.'}, status=404)
+
+
+async def aauthenticate(request):
+    '''JWT authentication without the thread hop of DRF's sync authenticators.'''
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        return None
+
+    try:
+        raw_token = authentication.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = authentication.get_validated_token(raw_token)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+
+    return await USER.objects.filter(
+        **{jwt_settings.USER_ID_FIELD: validated_token.get(jwt_settings.USER_ID_CLAIM)},
+        is_active=True,
+    ).afirst()
+
+
+async def ahas_perm(request, perm):
+    user = await aauthenticate(request)
+    if user is None:
+        return False
+    if user.is_superuser:
+        return True
+    return await sync_to_async(user.has_perm)(perm)
+
+
+async def paginate(request, queryset, serializer_class, prepare=None):
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 0
+
+    count = await queryset.acount()
+    start = (page - 1) * PAGE_SIZE
+    if page < 1 or (page > 1 and start >= count):
+        return json_response({'detail': 'Invalid page.'}, status=404)
+
+    objects = [obj async for obj in queryset[start:start + PAGE_SIZE].aiterator()]
+    if prepare is not None:
+        await sync_to_async(prepare)(objects)
+
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, 'page', page + 1) if start + PAGE_SIZE < count else None
+    previous_url = None
+    if page == 2:
+        previous_url = remove_query_param(url, 'page')
+    elif page > 2:
+        previous_url = replace_query_param(url, 'page', page - 1)
+
+    return json_response({
+        'count': count,
+        'next': next_url,
+        'previous': previous_url,
+        'results': serializer_class(objects, many=True).data,
+    })
+
+
+@require_GET
+async def product_list(request):
+    if not await ahas_perm(request, 'store.view_product'):
+        return json_response({'detail': 'You do not have permission to perform this action.'}, status=403)
+
+    queryset = models.Product.objects.select_related('category').order_by('id')
+    await sync_to_async(rates.get_rates)()
+    return await paginate(request, queryset, serializers.ProductSerializer, prepare=inventory.load_stock)
+
+
+@require_GET
+async def product_detail(request, pk):
+    if not await ahas_perm(request, 'store.view_product'):
+        return json_response({'detail': 'You do not have permission to perform this action.'}, status=403)
+
+    try:
+        product = await models.Product.objects.select_related('category').aget(pk=pk)
+    except models.Product.DoesNotExist:
+        return not_found()
+    await sync_to_async(rates.get_rates)()
+    await sync_to_async(inventory.load_stock)([product])
+    return json_response(serializers.ProductSerializer(product).data)
+
+
+def category_queryset():
+    return models.Category.objects.annotate(products_count=Count('products')).order_by('id')
+
+
+@require_GET
+async def category_list(request):
+    return await paginate(request, category_queryset(), serializers.AnnotatedCategorySerializer)
+
+
+@require_GET
+async def category_detail(request, pk):
+    try:
+        category = await category_queryset().aget(pk=pk)
+    except models.Category.DoesNotExist:
+        return not_found()
+    return json_response(serializers.AnnotatedCategorySerializer(category).data)
+
+
+def comment_queryset(product_pk):
+    return models.Comment.objects.select_related('product').filter(product_id=product_pk).order_by('id')
+
+
+@require_GET
+async def comment_list(request, product_pk):
+    return await paginate(request, comment_queryset(product_pk), serializers.CommentSerializer)
+
+
+@require_GET
+async def comment_detail(request, product_pk, pk):
+    try:
+        comment = await comment_queryset(product_pk).aget(pk=pk)
+    except models.Comment.DoesNotExist:
+        return not_found()
+    return json_response(serializers.CommentSerializer(comment).data)
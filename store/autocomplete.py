@@ -0,0 +1,196 @@
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+from django.db import connection
+
+from . import models
+
+
+PRODUCTS = 'products'
+CATEGORIES = 'categories'
+
+# word starts past this many words (or past MAX_OFFSET characters) are not searchable
+MAX_WORDS = 4
+MAX_OFFSET = 0xFF
+
+MAX_LIMIT = 50
+
+
+def clean(text):
+    return ' '.join(text.split())
+
+
+def word_offsets(text):
+    offsets = [0] + [i + 1 for i, char in enumerate(text) if char == ' ']
+    return [offset for offset in offsets[:MAX_WORDS] if offset <= MAX_OFFSET]
+
+
+class PrefixIndex:
+    '''
+    Sorted-array prefix index over product names and category titles.
+
+    Each text is stored once (interned) in `texts`, with its object id in the parallel `ids`
+    array. Per kind, `entries` holds (row << 8 | word offset) integers sorted by the lowercased
+    text from that word on, so a lookup is one bisect plus a scan over at most `limit` matches.
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # changes made while build() reads the catalog are queued and replayed once it is done
+        self.pending_lock = threading.Lock()
+        self.pending = None
+        self.reset()
+
+    def reset(self):
+        self.texts = []
+        self.ids = array('q')
+        self.free_rows = []
+        self.rows = {PRODUCTS: {}, CATEGORIES: {}}
+        self.entries = {PRODUCTS: array('Q'), CATEGORIES: array('Q')}
+        self.built = False
+
+    def _key(self, entry):
+        return self.texts[entry >> 8][entry & MAX_OFFSET:].lower()
+
+    def _new_row(self, kind, object_id, text):
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.texts[row], self.ids[row] = text, object_id
+        else:
+            row = len(self.texts)
+            self.texts.append(text)
+            self.ids.append(object_id)
+        self.rows[kind][object_id] = row
+        return row
+
+    def build(self, items):
+        '''Replaces the whole index, `items` yields (kind, id, text).'''
+        with self.pending_lock:
+            self.pending = []
+        with self.lock:
+            self.reset()
+            entries = {PRODUCTS: [], CATEGORIES: []}
+            for kind, object_id, text in items:
+                text = sys.intern(clean(text))
+                row = self._new_row(kind, object_id, text)
+                entries[kind].extend(row << 8 | offset for offset in word_offsets(text))
+            for kind, kind_entries in entries.items():
+                kind_entries.sort(key=self._key)
+                self.entries[kind] = array('Q', kind_entries)
+            with self.pending_lock:
+                pending, self.pending = self.pending, None
+            for method, args in pending:
+                method(*args)
+            self.built = True
+
+    @property
+    def loading(self):
+        return self.pending is not None
+
+    def _defer(self, method, *args):
+        with self.pending_lock:
+            if self.pending is None:
+                return False
+            self.pending.append((method, args))
+            return True
+
+    def update(self, kind, object_id, text):
+        if self._defer(self.update, kind, object_id, text):
+            return
+        text = sys.intern(clean(text))
+        with self.lock:
+            row = self.rows[kind].get(object_id)
+            if row is not None:
+                if self.texts[row] == text:
+                    return
+                self.remove(kind, object_id)
+
+            row = self._new_row(kind, object_id, text)
+            entries = self.entries[kind]
+            for offset in word_offsets(text):
+                entry = row << 8 | offset
+                entries.insert(bisect_left(entries, self._key(entry), key=self._key), entry)
+
+    def remove(self, kind, object_id):
+        if self._defer(self.remove, kind, object_id):
+            return
+        with self.lock:
+            row = self.rows[kind].pop(object_id, None)
+            if row is None:
+                return
+
+            entries = self.entries[kind]
+            for offset in word_offsets(self.texts[row]):
+                entry = row << 8 | offset
+                position = bisect_left(entries, self._key(entry), key=self._key)
+                while entries[position] != entry:
+                    position += 1
+                del entries[position]
+            self.texts[row] = None
+            self.free_rows.append(row)
+
+    def search(self, prefix, limit=10):
+        '''Returns {kind: [{'id': ..., 'text': ...}]}, at most `limit` objects per kind.'''
+        prefix = clean(prefix).lower()
+        results = {PRODUCTS: [], CATEGORIES: []}
+        if not prefix or not self.built:
+            return results
+
+        with self.lock:
+            for kind, entries in self.entries.items():
+                seen = set()
+                position = bisect_left(entries, prefix, key=self._key)
+                while position < len(entries) and len(seen) < limit:
+                    entry = entries[position]
+                    if not self._key(entry).startswith(prefix):
+                        break
+                    row = entry >> 8
+                    if row not in seen:
+                        seen.add(row)
+                        results[kind].append({'id': self.ids[row], 'text': self.texts[row]})
+                    position += 1
+        return results
+
+
+index = PrefixIndex()
+
+
+def catalog_items():
+    for product_id, name in models.Product.objects.values_list('id', 'name').iterator(chunk_size=5000):
+        yield PRODUCTS, product_id, name
+    for category_id, title in models.Category.objects.values_list('id', 'title').iterator(chunk_size=5000):
+        yield CATEGORIES, category_id, title
+
+
+_warm_up_thread = None
+
+
+def warm_up():
+    '''Starts loading the index in a background thread, called once the WSGI/ASGI application is up.'''
+    global _warm_up_thread
+    if _warm_up_thread is None:
+        _warm_up_thread = threading.Thread(target=_load, name='autocomplete-warm-up', daemon=True)
+        _warm_up_thread.start()
+    return _warm_up_thread
+
+
+def _load():
+    try:
+        if not index.built:
+            index.build(catalog_items())
+    finally:
+        connection.close()
+
+
+def get_index():
+    '''
+    The process-wide index. While warm_up() is loading it searches come back empty instead of
+    waiting on the build; processes that never warmed up (tests, shell) load it on first use.
+    '''
+    if not index.built and not index.loading and (_warm_up_thread is None or not _warm_up_thread.is_alive()):
+        with index.lock:
+            if not index.built:
+                index.build(catalog_items())
+    return index
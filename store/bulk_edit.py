@@ -0,0 +1,125 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, IntegerField, Max, Value
+from django.db.models.functions import Cast, Greatest, Round
+from django.utils import timezone
+
+from . import models
+from . import changes
+from . import inventory
+from .signals import products_bulk_changed
+
+
+BATCH_SIZE = 1000
+
+MODE_PERCENT = 'percent'
+MODE_ABSOLUTE = 'absolute'
+MODE_SET = 'set'
+MODES = [MODE_PERCENT, MODE_ABSOLUTE, MODE_SET]
+
+FIELDS = ['unit_price', 'inventory']
+# the largest value each column holds: unit_price has max_digits=6, inventory is a 32 bit integer
+MAX_VALUES = {'unit_price': Decimal('9999.99'), 'inventory': 2147483647}
+
+
+def adjusted(field, mode, value):
+    '''Expression for `field` after the adjustment, prices keep two decimals and neither goes below zero.'''
+    value = Decimal(value)
+    if mode == MODE_SET:
+        expression = Value(value)
+    elif mode == MODE_PERCENT:
+        expression = F(field) * Value(1 + value / 100)
+    else:
+        expression = F(field) + Value(value)
+
+    if field == 'inventory':
+        return Greatest(Cast(Round(expression), IntegerField()), Value(0))
+    return Greatest(Round(expression, 2), Value(Decimal('0.00')), output_field=DecimalField(max_digits=6, decimal_places=2))
+
+
+def batches(ids):
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start:start + BATCH_SIZE]
+
+
+def out_of_range(product_ids, adjustments):
+    '''
+    Fields of {field: (mode, value)} that would go over MAX_VALUES for some of the products.
+    Checked before adjust() because its batches commit one by one, an overflow halfway would
+    leave the earlier ones applied.
+    '''
+    fields = []
+    for field, (mode, value) in adjustments.items():
+        for batch in batches(product_ids):
+            highest = models.Product.objects.filter(id__in=batch).aggregate(highest=Max(adjusted(field, mode, value)))['highest']
+            if highest is not None and highest > MAX_VALUES[field]:
+                fields.append(field)
+                break
+    return fields
+
+
+def adjust(product_ids, adjustments):
+    '''
+    Applies {field: (mode, value)} to the products with one UPDATE per batch of ids,
+    each batch in its own short transaction together with its change feed entries.
+    Unknown ids are skipped.
+    '''
+    updates = {field: adjusted(field, mode, value) for field, (mode, value) in adjustments.items()}
+    existing = models.Product.objects.filter(id__in=set(product_ids)).values_list('id', flat=True)
+    updated = []
+    for batch in batches(sorted(existing)):
+        with transaction.atomic():
+            if 'inventory' in updates:
+                inventory.fold_shards(batch)
+            models.Product.objects.filter(id__in=batch).update(**updates, datetime_modified=timezone.now())
+            changes.record(*((changes.PRODUCT, product_id) for product_id in batch))
+        updated += batch
+
+    notify(updated)
+    return len(updated)
+
+
+def apply_price_list(rows):
+    '''
+    rows: {product_id: {'unit_price': ..., 'inventory': ...}}, either key may be missing.
+    Written with bulk_update in batches, grouped by the fields each row carries so a
+    missing value is never overwritten. Unknown ids are skipped.
+    '''
+    existing = models.Product.objects.filter(id__in=rows).values_list('id', flat=True)
+    updated = []
+    for batch in batches(sorted(existing)):
+        now = timezone.now()
+        groups = {}
+        for product_id in batch:
+            product = models.Product(id=product_id, datetime_modified=now, **rows[product_id])
+            groups.setdefault(tuple(sorted(rows[product_id])), []).append(product)
+
+        with transaction.atomic():
+            # rows setting inventory replace the whole stock, counter rows included
+            inventory.fold_shards([product_id for product_id in batch if 'inventory' in rows[product_id]])
+            for fields, products in groups.items():
+                models.Product.objects.bulk_update(products, [*fields, 'datetime_modified'])
+            changes.record(*((changes.PRODUCT, product_id) for product_id in batch))
+        updated += batch
+
+    notify(updated)
+    return len(updated)
+
+
+def parse_price_list(text):
+    '''"id,unit_price[,inventory]" per line, either value may be left empty, e.g. "12,,40".'''
+    rows = []
+    for line in text.splitlines():
+        values = [value.strip() for value in line.split(',')]
+        if not any(values):
+            continue
+        row = {'id': values[0]}
+        row.update({field: value for field, value in zip(FIELDS, values[1:]) if value})
+        rows.append(row)
+    return rows
+
+
+def notify(product_ids):
+    if product_ids:
+        products_bulk_changed.send(sender=models.Product, product_ids=product_ids)
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import models
+
+
+PRODUCT = models.CatalogChange.CHANGE_KIND_PRODUCT
+CATEGORY = models.CatalogChange.CHANGE_KIND_CATEGORY
+
+
+def get_settle_delay():
+    return timedelta(seconds=getattr(settings, 'CHANGE_FEED_SETTLE_SECONDS', 2))
+
+
+def get_retention():
+    return settings.CATALOG_CHANGES_RETENTION
+
+
+def record(*changes):
+    '''
+    Logs (kind, object_id) pairs once the caller's transaction commits, so entry ids follow
+    commit order however long the write took, and nothing is logged for a rollback.
+    A crash between the commit and the insert loses the entries.
+    '''
+    entries = [models.CatalogChange(kind=kind, object_id=object_id) for kind, object_id in changes if object_id is not None]
+    if entries:
+        transaction.on_commit(lambda: models.CatalogChange.objects.bulk_create(entries))
+
+
+def latest_cursor():
+    return models.CatalogChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def read(after, limit):
+    '''
+    Changes after the `after` cursor, at most `limit` of them: (changed ids per kind, cursor, has_more).
+    Entries younger than CHANGE_FEED_SETTLE_SECONDS are held back, and so is everything after
+    them, so an insert that took a lower id but commits a moment later is not skipped by the cursor.
+    Entries are inserted after the write commits, the window only has to cover that insert.
+    '''
+    settled = timezone.now() - get_settle_delay()
+    entries = (
+        models.CatalogChange.objects
+        .filter(id__gt=after)
+        .order_by('id')
+        .values_list('id', 'kind', 'object_id', 'datetime_created')[:limit + 1]
+    )
+
+    changed = {PRODUCT: set(), CATEGORY: set()}
+    cursor, has_more = after, False
+    for count, (change_id, kind, object_id, datetime_created) in enumerate(entries):
+        if count == limit or datetime_created > settled:
+            has_more = True
+            break
+        changed[kind].add(object_id)
+        cursor = change_id
+    return changed, cursor, has_more
+
+
+def current_products(ids):
+    return models.Product.objects.filter(id__in=ids).order_by('id')
+
+
+def current_categories(ids):
+    return models.Category.objects.filter(id__in=ids).annotate(products_count=Count('products')).order_by('id')
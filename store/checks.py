@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    '''
+    Rate and catalog versions, primary pins for cookie-less clients and THROTTLE_STORAGE = 'cache'
+    are coordinated through the default cache, which every worker must share.
+    '''
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DEBUG or backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            f'The default cache ({backend}) is not shared between worker processes.',
+            hint=(
+                'Use a shared backend such as Redis or Memcached, otherwise rate and catalog changes '
+                'only reach the worker that made them and the other workers serve stale data.'
+            ),
+            id='store.W001',
+        )
+    ]
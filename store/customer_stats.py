@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, Q, Sum, Value, When
+
+from . import models
+
+
+BATCH_SIZE = 1000
+
+
+def counted(status):
+    return status != models.Order.ORDER_STATUS_CANCELED
+
+
+def spent(status):
+    return status == models.Order.ORDER_STATUS_PAID
+
+
+def apply(customer_id, order_count=0, spend=0, last_order_at=None):
+    '''Adds the deltas to the customer's row with one conditional UPDATE, creating the row first if needed.'''
+    models.CustomerStats.objects.get_or_create(customer_id=customer_id)
+    update = {
+        'order_count': F('order_count') + order_count,
+        'lifetime_spend': F('lifetime_spend') + spend,
+    }
+    if last_order_at is not None:
+        update['last_order_at'] = Case(
+            When(last_order_at__gt=last_order_at, then=F('last_order_at')),
+            default=Value(last_order_at),
+        )
+    models.CustomerStats.objects.filter(customer_id=customer_id).update(**update)
+
+
+def record_order(order):
+    '''Called from post_save once the order row exists, however it was created.'''
+    apply(
+        order.customer_id,
+        order_count=1 if counted(order.status) else 0,
+        spend=order.total if spent(order.status) else 0,
+        last_order_at=order.datetime_created,
+    )
+
+
+def record_total_change(order, old_total):
+    '''Item edits move the total of an order after it was counted, only paid orders add to the spend.'''
+    if spent(order.status):
+        apply(order.customer_id, spend=order.total - old_total)
+
+
+def record_status_changes(changes):
+    '''changes: [(order_id, old_status, new_status), ...] as sent with order_status_changed.'''
+    orders = {
+        order_id: (customer_id, total) for order_id, customer_id, total in
+        models.Order.objects.filter(id__in=[order_id for order_id, old, new in changes]).values_list('id', 'customer_id', 'total')
+    }
+    deltas = {}
+    for order_id, old_status, new_status in changes:
+        if order_id not in orders:
+            continue
+        customer_id, total = orders[order_id]
+        order_count, spend = deltas.get(customer_id, (0, 0))
+        order_count += counted(new_status) - counted(old_status)
+        spend += total * (spent(new_status) - spent(old_status))
+        deltas[customer_id] = (order_count, spend)
+
+    # customers in id order, so concurrent bulk changes lock the rows in the same order
+    for customer_id, (order_count, spend) in sorted(deltas.items()):
+        if order_count or spend:
+            apply(customer_id, order_count, spend)
+
+
+def aggregate(model, customer_ids):
+    return (
+        model.objects
+        .filter(customer_id__in=customer_ids)
+        .values('customer_id')
+        .annotate(
+            order_count=Count('id', filter=~Q(status=models.Order.ORDER_STATUS_CANCELED)),
+            lifetime_spend=Sum('total', filter=Q(status=models.Order.ORDER_STATUS_PAID)),
+            last_order_at=Max('datetime_created'),
+        )
+        .order_by()
+    )
+
+
+def rebuild(customer_ids):
+    '''
+    Recomputes the rows of these customers from live and archived orders. Missing rows are
+    created and all of them locked before the orders are read, so a checkout committing meanwhile
+    is either counted here or applied after, and never races the rebuild to create a row.
+    Orders deleted outright are only reflected after a rebuild.
+    '''
+    with transaction.atomic():
+        models.CustomerStats.objects.bulk_create(
+            [models.CustomerStats(customer_id=customer_id) for customer_id in customer_ids], ignore_conflicts=True
+        )
+        list(models.CustomerStats.objects.select_for_update().filter(customer_id__in=customer_ids).order_by('pk').values_list('pk'))
+        stats = {customer_id: {'order_count': 0, 'lifetime_spend': 0, 'last_order_at': None} for customer_id in customer_ids}
+        for model in [models.Order, models.ArchivedOrder]:
+            for row in aggregate(model, customer_ids):
+                current = stats[row['customer_id']]
+                current['order_count'] += row['order_count']
+                current['lifetime_spend'] += row['lifetime_spend'] or 0
+                if current['last_order_at'] is None or row['last_order_at'] > current['last_order_at']:
+                    current['last_order_at'] = row['last_order_at']
+
+        for customer_id, values in stats.items():
+            models.CustomerStats.objects.update_or_create(customer_id=customer_id, defaults=values)
+    return sum(1 for values in stats.values() if values['last_order_at'] is not None)
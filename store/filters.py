@@ -1,12 +1,27 @@
-from django_filters.rest_framework import FilterSet
+from django_filters.rest_framework import FilterSet, NumberFilter
 
 from . import models 
 
 
+class CustomerFilter(FilterSet):
+    class Meta:
+        model = models.Customer
+        fields = {
+            'birth_date':['gte','lte'],
+            'user__date_joined':['gte','lte'],
+            'user__is_active':['exact'],
+        }
+
+
 class ProductFilter(FilterSet):
     class Meta:
         model = models.Product 
         fields = {
-            'inventory':['exact']
+            'inventory':['exact'],
+            'unit_price':['gte','lte'],
+            'datetime_modified':['gte','lte'],
         }
+    
+    # by id, without the category lookup a ModelChoiceFilter validates with
+    category_id = NumberFilter(field_name='category_id')
 
@@ -0,0 +1,66 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import models
+from . import renderers
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def get_window():
+    return settings.IDEMPOTENCY_KEY_WINDOW
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used with a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+def fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def claim(user_id, key, data):
+    '''
+    Inserts the key inside the caller's transaction and returns (record, created).
+    A concurrent duplicate blocks on the unique index until the first attempt commits
+    (and then gets its stored response) or rolls back (and then does the work itself).
+    '''
+    request_fingerprint = fingerprint(data)
+
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = models.IdempotencyKey.objects.create(user_id=user_id, key=key, fingerprint=request_fingerprint)
+            return record, True
+        except IntegrityError:
+            record = models.IdempotencyKey.objects.get(user_id=user_id, key=key)
+
+        if record.datetime_created >= timezone.now() - get_window():
+            break
+        record.delete()
+
+    if record.fingerprint != request_fingerprint:
+        raise IdempotencyKeyReused()
+    return record, False
+
+
+def store(record, status_code, data):
+    record.response_status = status_code
+    record.response_body = renderers.FastJSONRenderer().render(data)
+    record.save(update_fields=['response_status', 'response_body'])
+
+
+def replay(record):
+    response = HttpResponse(bytes(record.response_body), status=record.response_status, content_type='application/json')
+    response['Idempotent-Replayed'] = 'true'
+    return response
@@ -0,0 +1,175 @@
+import random
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import changes
+from . import models
+from .signals import products_bulk_changed
+
+
+# Every function here locks a product's counter rows before its product row, the order
+# take() reaches them in, so concurrent checkouts, folds and compactions cannot deadlock.
+
+def load_stock(products):
+    '''
+    Sets `stock` on each product: its inventory plus, for sharded products, the sum of
+    its counter rows, read with one query for the whole page.
+    '''
+    sharded = [product.pk for product in products if product.inventory_shard_count and not hasattr(product, 'stock')]
+    shard_totals = {}
+    if sharded:
+        shard_totals = dict(
+            models.InventoryShard.objects
+            .filter(product_id__in=sharded)
+            .values('product_id')
+            .annotate(total=Sum('count'))
+            .values_list('product_id', 'total')
+        )
+    for product in products:
+        if not hasattr(product, 'stock'):
+            product.stock = product.inventory + shard_totals.get(product.pk, 0)
+    return products
+
+
+def take(product, quantity):
+    '''
+    Removes `quantity` from the product's stock inside the caller's transaction and returns
+    whether there was enough. Every write is a conditional UPDATE, so stock never goes negative.
+    Sharded products try their counter rows in random order first so concurrent checkouts
+    lock different rows; the product row and finally all rows together are the fallbacks.
+    '''
+    shards = list(range(product.inventory_shard_count))
+    random.shuffle(shards)
+    for shard in shards:
+        if models.InventoryShard.objects.filter(
+            product_id=product.pk, shard=shard, count__gte=quantity
+        ).update(count=F('count') - quantity):
+            return True
+
+    if models.Product.objects.filter(pk=product.pk, inventory__gte=quantity).update(inventory=F('inventory') - quantity):
+        return True
+
+    if shards:
+        return take_spread(product, quantity)
+    return False
+
+
+def take_spread(product, quantity):
+    '''Takes from several counter rows at once, for quantities no single row holds.'''
+    with transaction.atomic():
+        shards = list(models.InventoryShard.objects.select_for_update().filter(product_id=product.pk).order_by('shard'))
+        base = models.Product.objects.select_for_update().only('inventory').get(pk=product.pk)
+        if base.inventory + sum(shard.count for shard in shards) < quantity:
+            return False
+
+        remaining = quantity
+        for shard in shards:
+            used = min(shard.count, remaining)
+            shard.count -= used
+            remaining -= used
+        models.InventoryShard.objects.bulk_update(shards, ['count'])
+        if remaining:
+            models.Product.objects.filter(pk=product.pk).update(inventory=F('inventory') - remaining)
+    return True
+
+
+def mark_changed(product_ids):
+    '''Marks the products modified, logs them to the change feed and sends products_bulk_changed, as a bulk edit does.'''
+    models.Product.objects.filter(id__in=product_ids).update(datetime_modified=timezone.now())
+    changes.record(*((changes.PRODUCT, product_id) for product_id in product_ids))
+    products_bulk_changed.send(sender=models.Product, product_ids=product_ids)
+
+
+def announce(product_ids):
+    '''Runs mark_changed after the caller's transaction commits.'''
+    product_ids = sorted(set(product_ids))
+    transaction.on_commit(lambda: mark_changed(product_ids))
+
+
+def sold_out(product_ids):
+    '''The ids among `product_ids` with no stock left, read from the primary.'''
+    return list(
+        models.Product.objects.using(DEFAULT_DB_ALIAS)
+        .filter(id__in=product_ids)
+        .alias(stock=F('inventory') + Coalesce(Sum('inventory_shards__count'), 0))
+        .filter(stock__lte=0)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+
+def announce_sold_out(product_ids):
+    '''
+    After a checkout commits, announces the products it sold out. Other decrements leave the
+    product row and the catalog caches alone, so listings show the stock as of the last
+    announcement until availability changes. Checked after commit, where concurrent checkouts
+    emptying different counter rows of one product all see the final stock.
+    '''
+    product_ids = sorted(set(product_ids))
+
+    def check():
+        emptied = sold_out(product_ids)
+        if emptied:
+            mark_changed(emptied)
+
+    transaction.on_commit(check)
+
+
+def fold_shards(product_ids):
+    '''
+    Moves the stock held in counter rows into Product.inventory inside the caller's transaction,
+    so writes that set or scale `inventory` apply to the whole stock. compact() spreads it again.
+    '''
+    totals = {}
+    for product_id, count in (
+        models.InventoryShard.objects.select_for_update()
+        .filter(product_id__in=product_ids, count__gt=0)
+        .order_by('product_id', 'shard')
+        .values_list('product_id', 'count')
+    ):
+        totals[product_id] = totals.get(product_id, 0) + count
+    if totals:
+        models.InventoryShard.objects.filter(product_id__in=totals).update(count=0)
+        for product_id, total in totals.items():
+            models.Product.objects.filter(pk=product_id).update(inventory=F('inventory') + total)
+
+
+def compact(product_id):
+    '''
+    Folds the counter rows back into Product.inventory and splits the total evenly again
+    over `inventory_shard_count` rows, or leaves it all in Product.inventory when that is 0.
+    '''
+    with transaction.atomic():
+        shards = {
+            shard.shard: shard
+            for shard in models.InventoryShard.objects.select_for_update().filter(product_id=product_id).order_by('shard')
+        }
+        product = models.Product.objects.select_for_update().only('inventory', 'inventory_shard_count').get(pk=product_id)
+        total = product.inventory + sum(shard.count for shard in shards.values())
+        shard_count = product.inventory_shard_count
+        per_shard = total // shard_count if shard_count else 0
+
+        models.InventoryShard.objects.filter(product_id=product_id, shard__gte=shard_count).delete()
+        existing = [shards[number] for number in range(shard_count) if number in shards]
+        for shard in existing:
+            shard.count = per_shard
+        models.InventoryShard.objects.bulk_update(existing, ['count'])
+        models.InventoryShard.objects.bulk_create([
+            models.InventoryShard(product_id=product_id, shard=number, count=per_shard)
+            for number in range(shard_count) if number not in shards
+        ])
+        models.Product.objects.filter(pk=product_id).update(inventory=total - per_shard * shard_count)
+    return total
+
+
+def products_to_compact():
+    return (
+        models.Product.objects
+        .filter(Q(inventory_shard_count__gt=0) | Q(inventory_shards__isnull=False))
+        .distinct()
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
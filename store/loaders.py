@@ -0,0 +1,137 @@
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import prefetch_related_objects
+from rest_framework import serializers
+
+
+class PerRowQueryError(AssertionError):
+    pass
+
+
+class RelationLoader:
+    '''
+    Request-scoped batch loader. Each relation path is resolved for a whole page at once:
+    forward foreign keys with one `pk__in` query per model (memoized for the request),
+    reverse relations through prefetch_related_objects.
+    '''
+
+    def __init__(self):
+        self.objects = {}
+
+    def load(self, instances, path):
+        current = [instance for instance in instances if instance is not None]
+
+        for name in path:
+            if not current:
+                break
+            try:
+                field = current[0]._meta.get_field(name)
+            except (FieldDoesNotExist, AttributeError):
+                return []
+            if not field.is_relation:
+                return []
+
+            if field.concrete and (field.many_to_one or field.one_to_one):
+                current = self._load_forward(current, field)
+            else:
+                prefetch_related_objects(current, name)
+                current = self._collect_reverse(current, field, name)
+
+        return current
+
+    def _load_forward(self, instances, field):
+        cache = self.objects.setdefault(field.related_model, {})
+        missing = {
+            getattr(instance, field.attname) for instance in instances
+            if not field.is_cached(instance)
+        } - cache.keys() - {None}
+
+        if missing:
+            for obj in field.related_model._default_manager.filter(pk__in=missing):
+                cache[obj.pk] = obj
+
+        related = []
+        for instance in instances:
+            if not field.is_cached(instance):
+                field.set_cached_value(instance, cache.get(getattr(instance, field.attname)))
+            obj = field.get_cached_value(instance)
+            if obj is not None:
+                cache.setdefault(obj.pk, obj)
+                related.append(obj)
+        return related
+
+    def _collect_reverse(self, instances, field, name):
+        if field.one_to_one:
+            return [getattr(instance, name, None) for instance in instances]
+        return [obj for instance in instances for obj in getattr(instance, name).all()]
+
+
+def get_loader(context):
+    request = context.get('request')
+    if request is None:
+        return RelationLoader()
+
+    request = getattr(request, '_request', request)
+    if not hasattr(request, '_relation_loader'):
+        request._relation_loader = RelationLoader()
+    return request._relation_loader
+
+
+def load_relations(serializer, instances, loader):
+    '''Walks the serializer's fields and batch loads every relation they read from.'''
+    instances = [instance for instance in instances if instance is not None]
+    if not instances:
+        return
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        is_nested = isinstance(nested, serializers.BaseSerializer)
+        path = field.source_attrs if is_nested else field.source_attrs[:-1]
+        if not path:
+            continue
+
+        related = loader.load(instances, path)
+        if is_nested and related:
+            load_relations(nested, related, loader)
+
+
+def block_queries(execute, sql, params, many, context):
+    raise PerRowQueryError(f'Query while serializing rows after batch loading: {sql}')
+
+
+def strict_mode():
+    '''In RELATION_LOADER_STRICT mode any query during per-row serialization raises.'''
+    stack = ExitStack()
+    if getattr(settings, 'RELATION_LOADER_STRICT', False):
+        for connection in connections.all(initialized_only=True):
+            stack.enter_context(connection.execute_wrapper(block_queries))
+    return stack
+
+
+class BatchLoadingListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        if self.parent is not None:
+            return super().to_representation(data)
+
+        instances = list(data.all() if hasattr(data, 'all') else data)
+        load_relations(self.child, instances, get_loader(self.context))
+        with strict_mode():
+            return super().to_representation(instances)
+
+
+class BatchLoadingMixin:
+    '''Root serializers load their nested relations through the request's RelationLoader.'''
+
+    def to_representation(self, instance):
+        if self.parent is not None:
+            return super().to_representation(instance)
+
+        load_relations(self, [instance], get_loader(self.context))
+        with strict_mode():
+            return super().to_representation(instance)
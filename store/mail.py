@@ -0,0 +1,112 @@
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import models
+
+
+ENQUEUE_BATCH_SIZE = 1000
+
+# a claimed message becomes due again after this, in case its worker died mid-batch
+LEASE = timedelta(minutes=10)
+
+RETRY_BASE_DELAY = timedelta(seconds=30)
+
+
+def get_max_attempts():
+    return settings.MAIL_QUEUE_MAX_ATTEMPTS
+
+
+def get_rate():
+    return settings.MAIL_QUEUE_RATE
+
+
+def enqueue(to, subject, body):
+    return models.QueuedEmail.objects.create(to=to, subject=subject, body=body)
+
+
+def enqueue_many(recipients, subject, body):
+    '''Queues the same message for every address `recipients` yields, in bulk inserts, returns the count.'''
+    recipients = iter(recipients)
+    queued = 0
+    while batch := list(islice(recipients, ENQUEUE_BATCH_SIZE)):
+        models.QueuedEmail.objects.bulk_create(
+            [models.QueuedEmail(to=to, subject=subject, body=body) for to in batch]
+        )
+        queued += len(batch)
+    return queued
+
+
+def claim(batch_size):
+    '''Leases up to `batch_size` due messages to this worker in one short transaction.'''
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            models.QueuedEmail.objects
+            .filter(status=models.QueuedEmail.EMAIL_STATUS_PENDING, send_after__lte=now)
+            .order_by('send_after', 'id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        models.QueuedEmail.objects.filter(id__in=[message.id for message in messages]).update(send_after=now + LEASE)
+    return messages
+
+
+def retry_delay(attempts):
+    return RETRY_BASE_DELAY * 2 ** (attempts - 1)
+
+
+class Sender:
+    '''
+    Sends claimed messages over one SMTP connection that stays open across batches,
+    at most `rate` messages per second. The connection is reopened after a failure.
+    '''
+
+    def __init__(self, rate=None, connection=None):
+        self.rate = rate or get_rate()
+        self.connection = connection or get_connection()
+        self.next_send = time.monotonic()
+
+    def close(self):
+        self.connection.close()
+
+    def wait_for_slot(self):
+        delay = self.next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_send = max(self.next_send, time.monotonic()) + 1 / self.rate
+
+    def send(self, messages):
+        '''Returns (sent, failed) counts.'''
+        sent = failed = 0
+        for message in messages:
+            self.wait_for_slot()
+            try:
+                self.connection.open()
+                EmailMessage(message.subject, message.body, to=[message.to], connection=self.connection).send()
+            except Exception as error:
+                self.connection.close()
+                self.mark_failed(message, error)
+                failed += 1
+            else:
+                models.QueuedEmail.objects.filter(id=message.id).update(
+                    status=models.QueuedEmail.EMAIL_STATUS_SENT,
+                    attempts=F('attempts') + 1,
+                    datetime_sent=timezone.now(),
+                )
+                sent += 1
+        return sent, failed
+
+    def mark_failed(self, message, error):
+        attempts = message.attempts + 1
+        update = {'attempts': attempts, 'last_error': f'{type(error).__name__}: {error}'}
+        if attempts >= get_max_attempts():
+            update['status'] = models.QueuedEmail.EMAIL_STATUS_FAILED
+        else:
+            update['send_after'] = timezone.now() + retry_delay(attempts)
+        models.QueuedEmail.objects.filter(id=message.id).update(**update)
@@ -0,0 +1,292 @@
+import json
+import re
+from collections import OrderedDict
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, models as db_models
+from django.db.migrations import Migration, AddIndex
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from store import models
+
+
+APP_LABEL = 'store'
+
+# routes replayed when no captured workload is given, ids are filled from the db
+BENCHMARK_ROUTES = [
+    'GET /store/products/',
+    'GET /store/products/?page=2',
+    'GET /store/products/?ordering=name',
+    'GET /store/products/?search=a',
+    'GET /store/products/{product_id}/',
+    'GET /store/products/{product_id}/comments/',
+    'GET /store/categories/',
+    'GET /store/categories/{category_id}/',
+    'GET /store/carts/{cart_id}/',
+    'GET /store/carts/{cart_id}/items/',
+    'GET /store/orders/',
+    'GET /store/customers/',
+]
+
+LITERAL_PATTERNS = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+IDENTIFIER = r'[`"]?(\w+)[`"]?'
+COLUMN_PREDICATE = re.compile(
+    IDENTIFIER + r'\.' + IDENTIFIER + r'\s*(=|IN\b|<=|>=|<|>|BETWEEN\b|LIKE\b|IS\b)',
+    re.IGNORECASE,
+)
+ORDER_BY_COLUMN = re.compile(IDENTIFIER + r'\.' + IDENTIFIER + r'(?:\s+(?:ASC|DESC))?', re.IGNORECASE)
+EQUALITY_OPERATORS = {'=', 'IN', 'IS'}
+
+
+def normalize_query(sql):
+    shape = sql
+    for pattern, replacement in LITERAL_PATTERNS:
+        shape = pattern.sub(replacement, shape)
+    return shape.strip()
+
+
+def split_clauses(sql):
+    upper = sql.upper()
+    where_at = upper.find(' WHERE ')
+    order_at = upper.rfind(' ORDER BY ')
+    limit_at = upper.rfind(' LIMIT ')
+
+    where = ''
+    if where_at != -1:
+        where_end = order_at if order_at > where_at else (limit_at if limit_at > where_at else len(sql))
+        where = sql[where_at + 7:where_end]
+
+    order_by = ''
+    if order_at != -1:
+        order_by = sql[order_at + 10:limit_at if limit_at > order_at else len(sql)]
+
+    return where, order_by
+
+
+class Explainer:
+    '''Runs EXPLAIN for the current backend and reports the flagged tables.'''
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.vendor = connection.vendor
+
+    def explain(self, sql):
+        prefix = 'EXPLAIN QUERY PLAN ' if self.vendor == 'sqlite' else 'EXPLAIN '
+        with self.connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            columns = [column[0].lower() for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return getattr(self, f'_flags_{self.vendor}', self._flags_generic)(rows), rows
+
+    def _flags_mysql(self, rows):
+        full_scans, filesorts = set(), set()
+        for row in rows:
+            extra = row.get('extra') or ''
+            if row.get('type') == 'ALL':
+                full_scans.add(row.get('table'))
+            if 'Using filesort' in extra or 'Using temporary' in extra:
+                filesorts.add(row.get('table'))
+        return full_scans, filesorts
+
+    def _flags_sqlite(self, rows):
+        full_scans, filesorts = set(), set()
+        for row in rows:
+            detail = row.get('detail') or ''
+            match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+            if match and 'INDEX' not in detail:
+                full_scans.add(match.group(1))
+            if 'USE TEMP B-TREE' in detail:
+                filesorts.add(None)
+        return full_scans, filesorts
+
+    def _flags_postgresql(self, rows):
+        full_scans, filesorts = set(), set()
+        for row in rows:
+            line = next(iter(row.values()), '') or ''
+            match = re.search(r'Seq Scan on (\w+)', line)
+            if match:
+                full_scans.add(match.group(1))
+            if re.search(r'->\s+Sort\b|^\s*Sort\b', line):
+                filesorts.add(None)
+        return full_scans, filesorts
+
+    def _flags_generic(self, rows):
+        return set(), set()
+
+
+class Command(BaseCommand):
+    help = 'Replays a captured workload or the benchmark routes, explains every distinct query shape and proposes indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workload', help='file with one "METHOD PATH [JSON BODY]" request per line')
+        parser.add_argument('--user', help='username the requests are authenticated as (defaults to the first superuser)')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--verbose-plans', action='store_true', help='print the raw EXPLAIN output of every shape')
+        parser.add_argument('--write-migration', action='store_true', help=f'write the proposed indexes as a new {APP_LABEL} migration')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        requests = self.load_requests(options['workload'])
+        client = self.build_client(options['user'])
+
+        shapes = OrderedDict()
+        with transaction.atomic(using=options['database']):
+            with CaptureQueriesContext(connection) as captured:
+                for method, path, body in requests:
+                    response = getattr(client, method.lower())(path, data=body, content_type='application/json')
+                    self.stdout.write(f'{method} {path} -> {response.status_code}')
+
+            for query in captured.captured_queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+                shape = normalize_query(sql)
+                entry = shapes.setdefault(shape, {'sql': sql, 'count': 0, 'time': 0.0})
+                entry['count'] += 1
+                entry['time'] += float(query['time'])
+
+            self.stdout.write(f'\n{len(captured.captured_queries)} queries, {len(shapes)} distinct select shapes\n')
+
+            explainer = Explainer(connection)
+            proposals = OrderedDict()
+            for shape, entry in shapes.items():
+                (full_scans, filesorts), plan = explainer.explain(entry['sql'])
+                if not full_scans and not filesorts:
+                    continue
+
+                self.stdout.write(self.style.WARNING(f'[x{entry["count"]} {entry["time"]:.3f}s] {shape}'))
+                for table in sorted(filter(None, full_scans)):
+                    self.stdout.write(f'    full scan on {table}')
+                if filesorts:
+                    self.stdout.write('    filesort / temporary b-tree for ORDER BY')
+                if options['verbose_plans']:
+                    for row in plan:
+                        self.stdout.write(f'    {row}')
+
+                for model, fields in self.propose(entry['sql'], full_scans | filesorts):
+                    proposals.setdefault((model, tuple(fields)), entry['count'])
+
+            transaction.set_rollback(True, using=options['database'])
+
+        if not proposals:
+            self.stdout.write(self.style.SUCCESS('No full scans or filesorts that an index would fix.'))
+            return
+
+        self.stdout.write('\nProposed indexes:')
+        for (model, fields), count in proposals.items():
+            self.stdout.write(f'    {model.__name__}: models.Index(fields={list(fields)})    # used by {count} queries')
+
+        if options['write_migration']:
+            path = self.write_migration(proposals)
+            self.stdout.write(self.style.SUCCESS(f'\nWrote {path}'))
+            self.stdout.write('Add the same models.Index entries to Meta.indexes so makemigrations stays in sync.')
+
+    def load_requests(self, workload):
+        if workload:
+            try:
+                with open(workload) as f:
+                    lines = [line.strip() for line in f]
+            except OSError as e:
+                raise CommandError(f'Cannot read workload {workload}: {e}')
+        else:
+            lines = self.benchmark_routes()
+
+        requests = []
+        for line in lines:
+            if not line or line.startswith('#'):
+                continue
+            method, _, rest = line.partition(' ')
+            path, _, body = rest.strip().partition(' ')
+            requests.append((method.upper(), path, json.loads(body) if body else None))
+        return requests
+
+    def benchmark_routes(self):
+        ids = {
+            'product_id': models.Product.objects.values_list('id', flat=True).first(),
+            'category_id': models.Category.objects.values_list('id', flat=True).first(),
+            'cart_id': models.Cart.objects.values_list('id', flat=True).first(),
+        }
+        return [
+            route.format(**ids) for route in BENCHMARK_ROUTES
+            if all(ids[name] is not None for name in re.findall(r'{(\w+)}', route))
+        ]
+
+    def build_client(self, username):
+        client = Client(raise_request_exception=False, SERVER_NAME='localhost', HTTP_ACCEPT='application/json')
+        users = get_user_model().objects
+        user = users.filter(username=username).first() if username else users.filter(is_superuser=True).first()
+        if username and user is None:
+            raise CommandError(f'There is no user named {username}')
+        if user is not None:
+            client.defaults['HTTP_AUTHORIZATION'] = f'JWT {RefreshToken.for_user(user).access_token}'
+        return client
+
+    def propose(self, sql, flagged_tables):
+        where, order_by = split_clauses(sql)
+        tables = {model._meta.db_table: model for model in apps.get_app_config(APP_LABEL).get_models()}
+
+        columns_by_table = OrderedDict()
+        for table, column, operator in COLUMN_PREDICATE.findall(where):
+            if table in tables:
+                equality = operator.upper() in EQUALITY_OPERATORS
+                columns_by_table.setdefault(table, {'equality': [], 'range': [], 'order': []})
+                bucket = columns_by_table[table]['equality' if equality else 'range']
+                if column not in bucket:
+                    bucket.append(column)
+        for table, column in ORDER_BY_COLUMN.findall(order_by):
+            if table in tables:
+                columns_by_table.setdefault(table, {'equality': [], 'range': [], 'order': []})
+                if column not in columns_by_table[table]['order']:
+                    columns_by_table[table]['order'].append(column)
+
+        for table, columns in columns_by_table.items():
+            if None not in flagged_tables and table not in flagged_tables:
+                continue
+            model = tables[table]
+            ordered = columns['equality'] + columns['range'][:1] + columns['order']
+            fields = []
+            for column in ordered:
+                field = next((f for f in model._meta.concrete_fields if f.column == column), None)
+                if field is not None and field.name not in fields:
+                    fields.append(field.name)
+            if fields and not self.is_covered(model, fields):
+                yield model, fields
+
+    def is_covered(self, model, fields):
+        existing = [list(index.fields) for index in model._meta.indexes]
+        existing += [list(together) for together in model._meta.unique_together]
+        existing += [[f.name] for f in model._meta.concrete_fields if f.db_index or f.unique or f.primary_key]
+        return any(index[:len(fields)] == fields for index in existing)
+
+    def write_migration(self, proposals):
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        leaf_nodes = loader.graph.leaf_nodes(APP_LABEL)
+        number = MigrationAutodetector.parse_number(leaf_nodes[0][1]) + 1 if leaf_nodes else 1
+
+        operations = []
+        for model, fields in proposals:
+            index = db_models.Index(fields=list(fields))
+            index.set_name_with_model(model)
+            operations.append(AddIndex(model_name=model._meta.model_name, index=index))
+
+        migration = Migration(f'{number:04d}_advised_indexes', APP_LABEL)
+        migration.dependencies = leaf_nodes
+        migration.operations = operations
+
+        writer = MigrationWriter(migration)
+        with open(writer.path, 'w') as f:
+            f.write(writer.as_string())
+        return writer.path
@@ -0,0 +1,30 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store import archive
+
+
+class Command(BaseCommand):
+    help = 'Moves paid and canceled orders older than ORDER_ARCHIVE_AFTER to the archive tables in small transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='archive orders older than this many days instead of ORDER_ARCHIVE_AFTER')
+        parser.add_argument('--batch-size', type=int, default=500, help='orders moved per transaction')
+        parser.add_argument('--sleep', type=float, default=0, help='seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        archive_after = timedelta(days=options['days']) if options['days'] is not None else archive.get_archive_after()
+        cutoff = timezone.now() - archive_after
+        self.stdout.write(f'Archiving paid and canceled orders created before {cutoff.isoformat()}')
+
+        total = 0
+        while moved := archive.archive_batch(cutoff, options['batch_size']):
+            total += moved
+            self.stdout.write(f'  {total} orders archived')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(f'Done: {total} orders archived')
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.test.utils import setup_test_environment
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from store import models
+
+
+# sync route and its async twin, ids are filled from the db
+ROUTES = [
+    ('/store/products/', '/store/async/products/'),
+    ('/store/products/{product_id}/', '/store/async/products/{product_id}/'),
+    ('/store/products/{product_id}/comments/', '/store/async/products/{product_id}/comments/'),
+    ('/store/categories/', '/store/async/categories/'),
+    ('/store/categories/{category_id}/', '/store/async/categories/{category_id}/'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Fires concurrent catalog reads through the ASGI handler against the sync and async views and compares throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='requests per route and implementation')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--user', help='username the product routes are read as (defaults to the first superuser)')
+
+    def handle(self, *args, **options):
+        product = models.Product.objects.order_by('id').first()
+        category = models.Category.objects.order_by('id').first()
+        if product is None or category is None:
+            raise CommandError('There is no product or category to read, run setup_fake_data first.')
+
+        users = get_user_model().objects
+        user = users.filter(username=options['user']).first() if options['user'] else users.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError('There is no user to authenticate the product routes with.')
+
+        setup_test_environment()
+        ids = {'product_id': product.id, 'category_id': category.id}
+        self.stdout.write(f'{options["requests"]} requests per route, concurrency {options["concurrency"]}\n')
+        self.stdout.write(f'{"route":<50}{"sync req/s":>12}{"async req/s":>13}{"speedup":>10}')
+
+        for sync_route, async_route in ROUTES:
+            sync_rate = asyncio.run(self.run(sync_route.format(**ids), user, options))
+            async_rate = asyncio.run(self.run(async_route.format(**ids), user, options))
+            self.stdout.write(f'{sync_route:<50}{sync_rate:>12.1f}{async_rate:>13.1f}{async_rate / sync_rate:>9.2f}x')
+
+    async def run(self, path, user, options):
+        # a fresh token per run, ACCESS_TOKEN_LIFETIME is short
+        client = AsyncClient()
+        headers = {
+            'accept': 'application/json',
+            'authorization': f'JWT {RefreshToken.for_user(user).access_token}',
+        }
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        statuses = set()
+
+        async def fetch():
+            async with semaphore:
+                response = await client.get(path, headers=headers)
+                statuses.add(response.status_code)
+
+        await fetch()
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch() for _ in range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        if statuses != {200}:
+            self.stderr.write(f'{path} answered with {sorted(statuses)}')
+        return options['requests'] / elapsed
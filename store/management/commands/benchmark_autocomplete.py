@@ -0,0 +1,69 @@
+import random
+import string
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from store import autocomplete
+
+
+class Command(BaseCommand):
+    help = 'Builds the autocomplete index over a synthetic catalog and measures build time, memory, lookup and update latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--categories', type=int, default=1_000)
+        parser.add_argument('--lookups', type=int, default=100_000)
+        parser.add_argument('--updates', type=int, default=1_000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = [
+            ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))).capitalize()
+            for _ in range(20_000)
+        ]
+
+        def phrase():
+            return ' '.join(rng.choices(vocabulary, k=rng.randint(1, 5)))
+
+        items = [(autocomplete.PRODUCTS, i, phrase()) for i in range(1, options['products'] + 1)]
+        items += [(autocomplete.CATEGORIES, i, phrase()) for i in range(1, options['categories'] + 1)]
+
+        index = autocomplete.PrefixIndex()
+        tracemalloc.start()
+        start = time.perf_counter()
+        index.build(iter(items))
+        build_seconds = time.perf_counter() - start
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del items
+
+        entries = sum(len(kind_entries) for kind_entries in index.entries.values())
+        self.stdout.write(f'built {len(index.texts)} texts / {entries} entries in {build_seconds:.2f}s')
+        self.stdout.write(f'memory {size / 2**20:.1f} MiB held, {peak / 2**20:.1f} MiB peak while building')
+
+        prefixes = [rng.choice(vocabulary)[:rng.randint(1, 6)] for _ in range(options['lookups'])]
+        timings = []
+        for prefix in prefixes:
+            start = time.perf_counter()
+            index.search(prefix, 10)
+            timings.append(time.perf_counter() - start)
+        self.report('lookup', timings)
+
+        timings = []
+        for _ in range(options['updates']):
+            product_id = rng.randint(1, options['products'])
+            start = time.perf_counter()
+            index.update(autocomplete.PRODUCTS, product_id, phrase())
+            timings.append(time.perf_counter() - start)
+        self.report('update', timings)
+
+    def report(self, name, timings):
+        timings.sort()
+        def micros(q):
+            return timings[min(int(len(timings) * q), len(timings) - 1)] * 1e6
+        self.stdout.write(
+            f'{name}: {len(timings)} ops, p50 {micros(0.5):.1f}us  p95 {micros(0.95):.1f}us  p99 {micros(0.99):.1f}us'
+        )
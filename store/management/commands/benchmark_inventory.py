@@ -0,0 +1,121 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from store import customer_stats
+from store import inventory
+from store import models
+from store import serializers
+from store.signals import products_bulk_changed
+
+
+class Command(BaseCommand):
+    help = 'Runs concurrent single-item stock decrements against one product for several shard counts and reports throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', default='0,4,16', help='comma separated shard counts to compare')
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--checkouts', type=int, default=2000, help='decrements per shard count')
+        parser.add_argument('--stock', type=int, default=1500, help='starting stock, less than --checkouts also exercises selling out')
+        parser.add_argument('--hold', type=float, default=0.002, help='seconds each checkout keeps its transaction open after the decrement')
+        parser.add_argument('--checkout', action='store_true', help='check out a one-item cart through OrderCreateSerializer, as POST /orders does, instead of calling inventory.take')
+
+    def handle(self, *args, **options):
+        category = models.Category.objects.first()
+        if category is None:
+            raise CommandError('There is no category to put the benchmark product in, run setup_fake_data first.')
+        self.customer = models.Customer.objects.first()
+        if options['checkout'] and self.customer is None:
+            raise CommandError('There is no customer to check out as, run setup_fake_data first.')
+
+        self.stdout.write(f'{options["threads"]} threads, {options["checkouts"]} checkouts, stock {options["stock"]}')
+        self.stdout.write(f'{"shards":>8}{"checkouts/s":>14}{"sold":>8}{"left":>8}{"retries":>9}{"announced":>11}')
+        for shard_count in [int(value) for value in options['shards'].split(',')]:
+            product = models.Product.objects.create(
+                name='inventory benchmark', description='', category=category, unit_price=1,
+                slug='inventory-benchmark', inventory=options['stock'], inventory_shard_count=shard_count,
+            )
+            try:
+                inventory.compact(product.id)
+                self.run(product, shard_count, options)
+            finally:
+                order_ids = list(models.OrderItem.objects.filter(product=product).values_list('order_id', flat=True))
+                models.OrderItem.objects.filter(product=product).delete()
+                models.Order.objects.filter(pk__in=order_ids).delete()
+                product.delete()
+                if options['checkout']:
+                    customer_stats.rebuild([self.customer.pk])
+
+    def checkout(self, product, cart_id):
+        '''One order through the checkout serializer, False when the product sold out.'''
+        serializer = serializers.OrderCreateSerializer(data={'cart_id': cart_id}, context={'user_id': self.customer.user_id})
+        serializer.is_valid(raise_exception=True)
+        try:
+            serializer.save()
+        except ValidationError:
+            return False
+        return True
+
+    def run(self, product, shard_count, options):
+        carts = []
+        if options['checkout']:
+            carts = models.Cart.objects.bulk_create([models.Cart() for _ in range(options['checkouts'])])
+            models.CartItem.objects.bulk_create([models.CartItem(cart=cart, product=product, quantity=1) for cart in carts])
+        remaining = iter(range(options['checkouts']))
+        lock = threading.Lock()
+        counts = {'sold': 0, 'retries': 0, 'announced': 0}
+
+        def announced(sender, product_ids, **kwargs):
+            if product.pk in product_ids:
+                with lock:
+                    counts['announced'] += 1
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        number = next(remaining, None)
+                        if number is None:
+                            return
+                    while True:
+                        try:
+                            with transaction.atomic():
+                                if carts:
+                                    sold = self.checkout(product, carts[number].pk)
+                                else:
+                                    sold = inventory.take(product, 1)
+                                time.sleep(options['hold'])
+                            break
+                        except OperationalError:
+                            # lock wait timeouts and deadlocks are retried like a client would
+                            with lock:
+                                counts['retries'] += 1
+                    if sold:
+                        with lock:
+                            counts['sold'] += 1
+            finally:
+                connection.close()
+
+        products_bulk_changed.connect(announced)
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            products_bulk_changed.disconnect(announced)
+        elapsed = time.perf_counter() - start
+        models.Cart.objects.filter(pk__in=[cart.pk for cart in carts]).delete()
+
+        product.refresh_from_db()
+        left = inventory.load_stock([product])[0].stock
+        if left < 0 or counts['sold'] + left != options['stock']:
+            self.stderr.write(f'stock mismatch: sold {counts["sold"]}, left {left}, started with {options["stock"]}')
+        self.stdout.write(
+            f'{shard_count:>8}{options["checkouts"] / elapsed:>14.1f}{counts["sold"]:>8}{left:>8}{counts["retries"]:>9}{counts["announced"]:>11}'
+        )
@@ -0,0 +1,68 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.utils.module_loading import import_string
+
+from store.middleware import BrowserOnlyMiddlewareMixin, is_api_request
+
+
+def stock_middleware(path):
+    '''The Django or toolbar class a Browser* middleware wraps, other entries unchanged.'''
+    middleware = import_string(path)
+    if not issubclass(middleware, BrowserOnlyMiddlewareMixin):
+        return path
+    base = middleware.__bases__[-1]
+    return f'{base.__module__}.{base.__name__}'
+
+
+class Command(BaseCommand):
+    help = 'Times full requests through the stock middleware stack, the path-aware one from MIDDLEWARE and no middleware at all'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', help='request path, repeatable, defaults to /store/ and /admin/login/')
+        parser.add_argument('--requests', type=int, default=2000, help='timed requests per path and stack')
+        parser.add_argument('--host', default='127.0.0.1')
+
+    def handle(self, *args, **options):
+        paths = options['path'] or ['/store/', '/admin/login/']
+        stacks = {
+            'stock': [stock_middleware(path) for path in settings.MIDDLEWARE],
+            'lean': list(settings.MIDDLEWARE),
+            # admin pages need request.user, so only API paths can run without middleware
+            'none': [],
+        }
+        factory = RequestFactory(SERVER_NAME=options['host'], HTTP_ACCEPT='application/json')
+
+        self.stdout.write(f'{options["requests"]} requests per row, median per request')
+        self.stdout.write(f'{"path":<20}{"stack":>8}{"status":>8}{"µs":>10}{"vs stock µs":>13}')
+        for path in paths:
+            stock = None
+            for name, middleware in stacks.items():
+                if not middleware and not is_api_request(factory.get(path)):
+                    continue
+                status, median = self.run(middleware, factory, path, options['requests'])
+                stock = median if stock is None else stock
+                self.stdout.write(f'{path:<20}{name:>8}{status:>8}{median:>10.0f}{median - stock:>+13.0f}')
+
+    def run(self, middleware, factory, path, count):
+        with override_settings(MIDDLEWARE=middleware):
+            handler = WSGIHandler()
+            statuses = []
+
+            def start_response(status, headers):
+                statuses.append(status.split()[0])
+
+            timings = []
+            for number in range(count + count // 10):
+                environ = factory.get(path).environ
+                start = time.perf_counter()
+                response = handler(environ, start_response)
+                response.close()
+                # the first tenth warms up caches and is not counted
+                if number >= count // 10:
+                    timings.append(time.perf_counter() - start)
+        return statuses[-1], statistics.median(timings) * 1e6
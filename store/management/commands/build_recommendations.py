@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from store import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Builds the frequently-bought-together table from OrderItem co-occurrence, incrementally from the last run unless --full'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='recompute every product')
+        parser.add_argument('--since', help='recompute products ordered since this ISO datetime')
+        parser.add_argument('--top-k', type=int, help='neighbors kept per product, defaults to RECOMMENDATIONS_TOP_K')
+        parser.add_argument('--block-size', type=int, default=500, help='products whose rows are counted in one pass')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f'Invalid --since datetime: {options["since"]}')
+        elif not options['full']:
+            since = recommendations.last_computed()
+
+        if since is None:
+            self.stdout.write('Recomputing all products')
+            product_ids = recommendations.all_product_ids()
+        else:
+            self.stdout.write(f'Recomputing products ordered since {since.isoformat()}')
+            product_ids = recommendations.changed_product_ids(since).iterator()
+
+        products = written = 0
+        for products, written in recommendations.rebuild(product_ids, options['block_size'], options['top_k']):
+            self.stdout.write(f'  {products} products, {written} recommendations written')
+        self.stdout.write(f'Done: {products} products, {written} recommendations')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store import changes
+from store.models import CatalogChange
+
+
+class Command(BaseCommand):
+    help = "Deletes change feed entries older than CATALOG_CHANGES_RETENTION"
+
+    def handle(self, *args, **kwargs):
+        deleted, _ = CatalogChange.objects.filter(
+            datetime_created__lt=timezone.now() - changes.get_retention()
+        ).delete()
+        self.stdout.write(f"Deleted {deleted} expired catalog changes")
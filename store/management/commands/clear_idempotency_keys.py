@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store import idempotency
+from store.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Deletes checkout Idempotency-Keys older than IDEMPOTENCY_KEY_WINDOW"
+
+    def handle(self, *args, **kwargs):
+        deleted, _ = IdempotencyKey.objects.filter(
+            datetime_created__lt=timezone.now() - idempotency.get_window()
+        ).delete()
+        self.stdout.write(f"Deleted {deleted} expired idempotency keys")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store import inventory
+
+
+class Command(BaseCommand):
+    help = "Folds sharded inventory counters back into Product.inventory and rebalances the shards"
+
+    def handle(self, *args, **kwargs):
+        compacted = 0
+        for product_id in inventory.products_to_compact():
+            inventory.compact(product_id)
+            compacted += 1
+        self.stdout.write(f"Compacted the inventory of {compacted} products")
@@ -0,0 +1,59 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import user_import
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports users with their customer profiles from CSV or JSONL in paired bulk inserts, '
+        'hashing passwords in a process pool. Resumable with --checkpoint'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='fields: username, email, password (raw or a Django hash), first_name, last_name, phone_number, birth_date')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000, help='users inserted per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='password hashing processes')
+        parser.add_argument('--checkpoint', help='file holding the number of rows done, updated after every batch and read on start')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist.')
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+        done = self.read_checkpoint(options['checkpoint'])
+        if done:
+            self.stdout.write(f'Resuming after row {done}')
+
+        rows = islice(user_import.read_rows(path, file_format), done, None)
+        totals = {'created': 0, 'existing': 0, 'invalid': 0}
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=user_import.init_worker) as pool:
+            while batch := list(islice(rows, options['batch_size'])):
+                for outcome, count in user_import.import_batch(batch, pool).items():
+                    totals[outcome] += count
+                done += len(batch)
+                self.write_checkpoint(options['checkpoint'], done)
+                self.stdout.write(f'  {done} rows: {self.summary(totals)}')
+
+        self.stdout.write(f'Done: {self.summary(totals)}')
+
+    def summary(self, totals):
+        return f'{totals["created"]} created, {totals["existing"]} already existing, {totals["invalid"]} missing username or email'
+
+    def read_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+
+    def write_checkpoint(self, path, done):
+        if not path:
+            return
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(str(done))
+        os.replace(f'{path}.tmp', path)
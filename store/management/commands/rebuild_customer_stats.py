@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from store import customer_stats
+from store import models
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the customer stats table from live and archived orders, one transaction per batch of customers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=customer_stats.BATCH_SIZE, help='customers per transaction')
+
+    def handle(self, *args, **options):
+        customers = with_orders = last_id = 0
+        while batch := list(
+            models.Customer.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+        ):
+            with_orders += customer_stats.rebuild(batch)
+            customers += len(batch)
+            last_id = batch[-1]
+            self.stdout.write(f'  {customers} customers')
+
+        self.stdout.write(f'Done: {customers} customers, {with_orders} with orders')
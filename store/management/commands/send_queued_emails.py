@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import mail
+
+
+class Command(BaseCommand):
+    help = 'Sends queued emails in batches over one SMTP connection, with retries and a rate limit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--rate', type=float, help='messages per second, defaults to MAIL_QUEUE_RATE')
+        parser.add_argument('--loop', action='store_true', help='keep polling the queue instead of exiting once it is empty')
+        parser.add_argument('--idle-sleep', type=float, default=5, help='seconds to wait when the queue is empty in --loop mode')
+
+    def handle(self, *args, **options):
+        sender = mail.Sender(rate=options['rate'])
+        total_sent = total_failed = 0
+        try:
+            while True:
+                messages = mail.claim(options['batch_size'])
+                if not messages:
+                    if not options['loop']:
+                        break
+                    sender.close()
+                    time.sleep(options['idle_sleep'])
+                    continue
+
+                sent, failed = sender.send(messages)
+                total_sent += sent
+                total_failed += failed
+                self.stdout.write(f'  batch of {len(messages)}: {sent} sent, {failed} failed')
+        finally:
+            sender.close()
+
+        self.stdout.write(f'Done: {total_sent} sent, {total_failed} failed')
@@ -0,0 +1,106 @@
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Sum
+from django.test import Client
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from store import models
+
+
+class Command(BaseCommand):
+    help = 'Requests the hottest catalog routes after a deploy to fill the response cache and the database buffers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20, help='top categories by product count to fetch')
+        parser.add_argument('--product-pages', type=int, default=5, help='product list pages to fetch')
+        parser.add_argument('--category-pages', type=int, default=2, help='category list pages to fetch')
+        parser.add_argument('--products', type=int, default=200, help='most ordered products to fetch')
+        parser.add_argument('--days', type=int, default=30, help='order window used to rank products')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--host', help='host the responses are cached for (defaults to the first ALLOWED_HOSTS entry)')
+        parser.add_argument('--secure', action='store_true', help='cache the https variant of the routes')
+        parser.add_argument('--user', help='username the requests are authenticated as (defaults to the first superuser)')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects
+        user = users.filter(username=options['user']).first() if options['user'] else users.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError('There is no user to authenticate the product routes with.')
+
+        self.host = options['host'] or next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        self.secure = options['secure']
+        self.token = f'JWT {RefreshToken.for_user(user).access_token}'
+        self.local = threading.local()
+
+        paths = self.hot_paths(options)
+        self.stdout.write(f'Warming {len(paths)} routes on {self.host} with {options["workers"]} workers')
+
+        statuses = Counter()
+        start = time.perf_counter()
+        step = max(len(paths) // 10, 1)
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(self.fetch, path) for path in paths]
+            for done, future in enumerate(as_completed(futures), 1):
+                path, status_code = future.result()
+                statuses[status_code] += 1
+                if status_code != 200:
+                    self.stderr.write(f'{path} answered with {status_code}')
+                if done % step == 0 or done == len(paths):
+                    self.stdout.write(f'  {done}/{len(paths)} in {time.perf_counter() - start:.1f}s')
+
+        summary = ', '.join(f'{count} x {status_code}' for status_code, count in sorted(statuses.items()))
+        self.stdout.write(f'Done in {time.perf_counter() - start:.1f}s: {summary}')
+
+    def hot_paths(self, options):
+        paths = self.list_pages('/store/products/', models.Product.objects.count(), options['product_pages'])
+        paths += self.list_pages('/store/categories/', models.Category.objects.count(), options['category_pages'])
+
+        categories = (
+            models.Category.objects
+            .annotate(products_count=Count('products'))
+            .order_by('-products_count', 'id')
+            .values_list('id', flat=True)[:options['categories']]
+        )
+        paths += [f'/store/categories/{category_id}/' for category_id in categories]
+
+        since = timezone.now() - timedelta(days=options['days'])
+        products = (
+            models.OrderItem.objects
+            .filter(order__datetime_created__gte=since)
+            .values('product_id')
+            .annotate(ordered=Sum('quantity'))
+            .order_by('-ordered', 'product_id')
+            .values_list('product_id', flat=True)[:options['products']]
+        )
+        paths += [f'/store/products/{product_id}/' for product_id in products]
+        return paths
+
+    def list_pages(self, path, count, pages):
+        pages = min(pages, max(math.ceil(count / settings.REST_FRAMEWORK['PAGE_SIZE']), 1))
+        return [path] + [f'{path}?page={page}' for page in range(2, pages + 1)]
+
+    def fetch(self, path):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(
+                raise_request_exception=False,
+                SERVER_NAME=self.host,
+                HTTP_ACCEPT='application/json',
+                HTTP_AUTHORIZATION=self.token,
+            )
+        try:
+            response = client.get(path, secure=self.secure)
+            return path, response.status_code
+        finally:
+            # worker threads open their own connections
+            connection.close()
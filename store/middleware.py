@@ -0,0 +1,139 @@
+import random
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from debug_toolbar.middleware import DebugToolbarMiddleware
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+from rest_framework.permissions import SAFE_METHODS
+
+from . import replicas
+from . import profiling
+
+
+class HybridMiddleware:
+    '''
+    Runs in whichever mode the next handler has, like Django's MiddlewareMixin, so an ASGI
+    chain reaches the async views without being adapted to sync. Subclasses implement
+    __call__ for sync and __acall__ for async handlers.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+class PrimaryPinMiddleware(HybridMiddleware):
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replicas.get_replicas():
+            replicas.pin_to_primary(request, response)
+        return response
+
+
+class SamplingProfilerMiddleware(HybridMiddleware):
+    '''Profiles a PROFILE_SAMPLE_RATE fraction of requests into per-endpoint aggregates, see store.profiling.'''
+
+    def sampled(self):
+        sample_rate = profiling.get_sample_rate()
+        return sample_rate and random.random() < sample_rate
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        return profiling.profile(request, self.get_response)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        # a sampled request gets a thread of its own, on the event loop its stacks would mix with other requests
+        return await sync_to_async(profiling.profile, thread_sensitive=False)(request, async_to_sync(self.get_response))
+
+
+def is_api_request(request):
+    return request.path_info.startswith(tuple(settings.API_PATH_PREFIXES))
+
+
+class BrowserOnlyMiddlewareMixin:
+    '''
+    Hands API_PATH_PREFIXES requests straight to the next layer. The API authenticates with
+    JWT only, so sessions, CSRF, messages and the toolbar are only needed by /admin/ and
+    other browser pages. Subclassing keeps the admin and toolbar system checks satisfied.
+    '''
+
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class BrowserSessionMiddleware(BrowserOnlyMiddlewareMixin, SessionMiddleware):
+    pass
+
+
+class BrowserCsrfViewMiddleware(BrowserOnlyMiddlewareMixin, CsrfViewMiddleware):
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            # the handler would wrap the sync hook in sync_to_async, a thread hop on every API request
+            self.process_view = self.aprocess_view
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        # called by the handler directly, not through __call__
+        if is_api_request(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+    async def aprocess_view(self, request, callback, callback_args, callback_kwargs):
+        if is_api_request(request):
+            return None
+        return await sync_to_async(super().process_view)(request, callback, callback_args, callback_kwargs)
+
+
+class BrowserAuthenticationMiddleware(BrowserOnlyMiddlewareMixin, AuthenticationMiddleware):
+    '''Needs the session, API views get request.user from DRF's JWT authentication instead.'''
+
+
+class BrowserMessageMiddleware(BrowserOnlyMiddlewareMixin, MessageMiddleware):
+    pass
+
+
+class BrowserDebugToolbarMiddleware(BrowserOnlyMiddlewareMixin, DebugToolbarMiddleware):
+    '''
+    The toolbar is sync only. Under ASGI, API requests go straight on to the async handler and
+    only browser pages run the toolbar in a thread, instead of the whole chain being adapted.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.is_async = iscoroutinefunction(get_response)
+        self.next_response = get_response
+        super().__init__(async_to_sync(get_response) if self.is_async else get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if is_api_request(request):
+            return await self.next_response(request)
+        return await sync_to_async(DebugToolbarMiddleware.__call__)(self, request)
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.3 on 2026-10-19 04:28
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def seed_rates(apps, schema_editor):
+    Rate = apps.get_model('store', 'Rate')
+    # the router sends writes to the primary, the rows belong in the database being migrated
+    db_alias = schema_editor.connection.alias
+    Rate.objects.using(db_alias).create(kind='c', code='IRR', value=Decimal('500000'))
+    Rate.objects.using(db_alias).create(kind='t', code='VAT', value=Decimal('0.09'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('c', 'Currency per dollar'), ('t', 'Tax')], default='c', max_length=1)),
+                ('code', models.CharField(max_length=10)),
+                ('value', models.DecimalField(decimal_places=6, max_digits=18)),
+                ('datetime_modified', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('kind', 'code')},
+            },
+        ),
+        migrations.RunPython(seed_rates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.3 on 2026-10-19 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_productrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('p', 'Product'), ('c', 'Category')], max_length=1)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('datetime_created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['datetime_modified'], name='store_produ_datetim_4321b0_idx'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.0.3 on 2026-10-19 05:13
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def fill_totals(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    for order_model, item_model in [('Order', 'OrderItem'), ('ArchivedOrder', 'ArchivedOrderItem')]:
+        Order = apps.get_model('store', order_model)
+        Item = apps.get_model('store', item_model)
+        totals = (
+            Item.objects.using(db_alias).values('order_id')
+            .annotate(item_count=Sum('quantity'), subtotal=Sum(F('quantity') * F('unit_price')))
+            .order_by('order_id')
+        )
+        batch = []
+        for row in totals.iterator():
+            batch.append(Order(id=row['order_id'], item_count=row['item_count'], subtotal=row['subtotal'], total=row['subtotal']))
+            if len(batch) == 1000:
+                Order.objects.using(db_alias).bulk_update(batch, ['item_count', 'subtotal', 'total'])
+                batch = []
+        Order.objects.using(db_alias).bulk_update(batch, ['item_count', 'subtotal', 'total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_queuedemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['total'], name='store_order_total_2b7a3a_idx'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
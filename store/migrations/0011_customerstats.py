@@ -0,0 +1,53 @@
+# Generated by Django 5.0.3 on 2026-10-19 05:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def fill_stats(apps, schema_editor):
+    # the stats are applied as deltas from here on, so every customer with orders needs a complete row
+    db_alias = schema_editor.connection.alias
+    CustomerStats = apps.get_model('store', 'CustomerStats')
+    stats = {}
+    for order_model in ['Order', 'ArchivedOrder']:
+        Order = apps.get_model('store', order_model)
+        rows = (
+            Order.objects.using(db_alias).values('customer_id')
+            .annotate(
+                order_count=Count('id', filter=~Q(status='c')),
+                lifetime_spend=Sum('total', filter=Q(status='p')),
+                last_order_at=Max('datetime_created'),
+            )
+            .order_by('customer_id')
+        )
+        for row in rows.iterator():
+            current = stats.setdefault(row['customer_id'], CustomerStats(customer_id=row['customer_id'], order_count=0, lifetime_spend=0))
+            current.order_count += row['order_count']
+            current.lifetime_spend += row['lifetime_spend'] or 0
+            if current.last_order_at is None or row['last_order_at'] > current.last_order_at:
+                current.last_order_at = row['last_order_at']
+    CustomerStats.objects.using(db_alias).bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='store.customer')),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('lifetime_spend', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('last_order_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['lifetime_spend'], name='store_custo_lifetim_13cb9b_idx'), models.Index(fields=['order_count'], name='store_custo_order_c_e8de60_idx')],
+            },
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
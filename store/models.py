@@ -1,8 +1,12 @@
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Sum
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from uuid import uuid4 
 
+from .signals import order_status_changed, order_total_changed
+
 USER = get_user_model()
 
 class Category(models.Model):
@@ -31,14 +35,31 @@ class Product(models.Model):
     discount = models.ManyToManyField(Discount,blank=True,related_name='products')
     slug = models.SlugField()
     inventory = models.IntegerField(validators=[MinValueValidator(0)])
+    # hot products spread their stock over this many InventoryShard rows, 0 keeps it all in `inventory`
+    inventory_shard_count = models.PositiveSmallIntegerField(default=0)
     
     datetime_created = models.DateTimeField(auto_now_add=True)
     datetime_modified = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['category','name']),
+            models.Index(fields=['datetime_modified']),
+        ]
+    
     def __str__(self):
         return f'{self.name}'
     
     
+class InventoryShard(models.Model):
+    product = models.ForeignKey(Product,on_delete=models.CASCADE,related_name='inventory_shards')
+    shard = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = [['product','shard']]
+    
+    
 class Customer(models.Model):
     user = models.OneToOneField(USER,on_delete=models.PROTECT)
     phone_number = models.CharField(max_length=255)
@@ -69,10 +90,58 @@ class Customer(models.Model):
         return f'{self.user.first_name} {self.user.last_name}'
     
     
+class CustomerStats(models.Model):
+    '''Kept up to date by store.customer_stats at checkout and on status changes, no row means no orders yet.'''
+    customer = models.OneToOneField(Customer,on_delete=models.CASCADE,primary_key=True,related_name='stats')
+    # orders that are not canceled
+    order_count = models.PositiveIntegerField(default=0)
+    # totals of paid orders
+    lifetime_spend = models.DecimalField(max_digits=14,decimal_places=2,default=0)
+    last_order_at = models.DateTimeField(null=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['lifetime_spend']),
+            models.Index(fields=['order_count']),
+        ]
+    
+    
 class OrderManager(models.Manager):
     def get_unpaid(self):
         return self.get_queryset().filter(status=Order.ORDER_STATUS_UNPAID)
     
+    def bulk_transition(self,changes):
+        '''
+        Applies {order_id: new_status} with one UPDATE per target status and returns
+        {order_id: {'from': old_status, 'to': new_status, 'error': message or None}}.
+        '''
+        results = {}
+        with transaction.atomic():
+            current = dict(
+                self.get_queryset().select_for_update().filter(id__in=changes.keys()).values_list('id','status')
+            )
+            
+            applied = []
+            ids_by_target = {}
+            for order_id, target in changes.items():
+                old_status = current.get(order_id)
+                results[order_id] = {'from': old_status, 'to': target, 'error': None}
+                if old_status is None:
+                    results[order_id]['error'] = 'Order not found.'
+                elif target not in Order.ALLOWED_STATUS_TRANSITIONS.get(old_status, ()):
+                    results[order_id]['error'] = f'Cannot change status from {old_status} to {target}.'
+                else:
+                    ids_by_target.setdefault(target,[]).append(order_id)
+                    applied.append((order_id,old_status,target))
+            
+            for target, order_ids in ids_by_target.items():
+                self.get_queryset().filter(id__in=order_ids).update(status=target)
+            
+            if applied:
+                order_status_changed.send(sender=Order,changes=applied)
+        
+        return results
+    
     
 class UnpaidOrderManager(models.Manager):
     def get_queryset(self):
@@ -88,12 +157,65 @@ class Order(models.Model):
         (ORDER_STATUS_UNPAID, 'Unpaid'),
         (ORDER_STATUS_CANCELED, 'Canceled'),
     ]
+    ALLOWED_STATUS_TRANSITIONS = {
+        ORDER_STATUS_UNPAID: {ORDER_STATUS_PAID, ORDER_STATUS_CANCELED},
+        ORDER_STATUS_PAID: {ORDER_STATUS_CANCELED},
+        ORDER_STATUS_CANCELED: set(),
+    }
+    TOTAL_FIELDS = ['item_count','subtotal','discount','total']
     customer = models.ForeignKey(Customer,on_delete=models.PROTECT,related_name='orders')
     status = models.CharField(max_length=1,choices=ORDER_STATUS,default=ORDER_STATUS_UNPAID)
     
     datetime_created = models.DateTimeField(auto_now_add=True)
     
+    # denormalized from the items by set_totals, so listing and sorting orders never reads OrderItem
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12,decimal_places=2,default=0)
+    discount = models.DecimalField(max_digits=12,decimal_places=2,default=0)
+    total = models.DecimalField(max_digits=12,decimal_places=2,default=0)
     
+    objects = OrderManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer','status','datetime_created']),
+            models.Index(fields=['total']),
+        ]
+    
+    def save(self,*args,**kwargs):
+        '''Status edits outside bulk_transition (PATCH, admin) send order_status_changed as well.'''
+        update_fields = kwargs.get('update_fields')
+        if self.pk is None or (update_fields is not None and 'status' not in update_fields):
+            return super().save(*args,**kwargs)
+        
+        with transaction.atomic():
+            old_status = Order.objects.select_for_update().filter(pk=self.pk).values_list('status',flat=True).first()
+            super().save(*args,**kwargs)
+            if old_status is not None and old_status != self.status:
+                order_status_changed.send(sender=Order,changes=[(self.pk,old_status,self.status)])
+    
+    def set_totals(self,items):
+        self.item_count = sum(item.quantity for item in items)
+        self.subtotal = sum((item.quantity * item.unit_price for item in items),0)
+        self.discount = sum((item.discount for item in items),0)
+        self.total = self.subtotal - self.discount
+    
+    def update_totals(self):
+        '''Recomputes the totals from the items in the database, after items were edited directly.'''
+        with transaction.atomic():
+            old_total, self.status = Order.objects.select_for_update().values_list('total','status').get(pk=self.pk)
+            totals = self.items.aggregate(
+                item_count=Sum('quantity'),
+                subtotal=Sum(F('quantity') * F('unit_price')),
+                discount=Sum('discount'),
+            )
+            self.item_count = totals['item_count'] or 0
+            self.subtotal = totals['subtotal'] or 0
+            self.discount = totals['discount'] or 0
+            self.total = self.subtotal - self.discount
+            self.save(update_fields=self.TOTAL_FIELDS)
+            if self.total != old_total:
+                order_total_changed.send(sender=Order,order=self,old_total=old_total)
     
     def __str__(self):
         return f'order id = {self.id}'
@@ -124,17 +246,134 @@ class Comment(models.Model):
     datetime_created = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=2,choices=COMMENT_STATUS,default=COMMENT_STATUS_WAITING)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['product','status']),
+        ]
+    
         
 class OrderItem(models.Model):
     order = models.ForeignKey(Order,on_delete=models.PROTECT,related_name='items')
     product = models.ForeignKey(Product,on_delete=models.PROTECT,related_name='order_items')
     quantity = models.PositiveSmallIntegerField()
     unit_price = models.DecimalField(max_digits=6,decimal_places=2)
+    # amount taken off the whole line at checkout
+    discount = models.DecimalField(max_digits=10,decimal_places=2,default=0)
     
     class Meta:
         unique_together = [['order','product']]
         
         
+class ArchivedOrder(models.Model):
+    '''Cold copy of an Order moved out of the live tables by archive_orders, ids are kept.'''
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(Customer,on_delete=models.PROTECT,related_name='archived_orders')
+    status = models.CharField(max_length=1,choices=Order.ORDER_STATUS)
+    datetime_created = models.DateTimeField()
+    datetime_archived = models.DateTimeField(auto_now_add=True)
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12,decimal_places=2,default=0)
+    discount = models.DecimalField(max_digits=12,decimal_places=2,default=0)
+    total = models.DecimalField(max_digits=12,decimal_places=2,default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer','datetime_created']),
+            models.Index(fields=['datetime_created']),
+        ]
+    
+    
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder,on_delete=models.CASCADE,related_name='items')
+    product = models.ForeignKey(Product,on_delete=models.PROTECT,related_name='archived_order_items')
+    quantity = models.PositiveSmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6,decimal_places=2)
+    discount = models.DecimalField(max_digits=10,decimal_places=2,default=0)
+    
+    
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey(Product,on_delete=models.CASCADE,related_name='recommendations')
+    recommended = models.ForeignKey(Product,on_delete=models.CASCADE,related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    # number of orders containing both products
+    score = models.PositiveIntegerField()
+    datetime_computed = models.DateTimeField()
+    
+    class Meta:
+        unique_together = [['product','rank']]
+        
+        
+class CatalogChange(models.Model):
+    '''Append-only log of catalog writes, the id is the change feed cursor.'''
+    CHANGE_KIND_PRODUCT = 'p'
+    CHANGE_KIND_CATEGORY = 'c'
+    CHANGE_KIND = [
+        (CHANGE_KIND_PRODUCT, 'Product'),
+        (CHANGE_KIND_CATEGORY, 'Category'),
+    ]
+    kind = models.CharField(max_length=1,choices=CHANGE_KIND)
+    object_id = models.PositiveBigIntegerField()
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    
+    
+class Rate(models.Model):
+    RATE_KIND_CURRENCY = 'c'
+    RATE_KIND_TAX = 't'
+    RATE_KIND = [
+        (RATE_KIND_CURRENCY, 'Currency per dollar'),
+        (RATE_KIND_TAX, 'Tax'),
+    ]
+    kind = models.CharField(max_length=1,choices=RATE_KIND,default=RATE_KIND_CURRENCY)
+    code = models.CharField(max_length=10)
+    value = models.DecimalField(max_digits=18,decimal_places=6)
+    datetime_modified = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = [['kind','code']]
+    
+    def __str__(self):
+        return f'{self.code} = {self.value}'
+    
+    
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(USER,on_delete=models.CASCADE,related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.BinaryField(null=True)
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = [['user','key']]
+        
+        
+class QueuedEmail(models.Model):
+    EMAIL_STATUS_PENDING = 'w'
+    EMAIL_STATUS_SENT = 's'
+    EMAIL_STATUS_FAILED = 'f'
+    EMAIL_STATUS = [
+        (EMAIL_STATUS_PENDING, 'Pending'),
+        (EMAIL_STATUS_SENT, 'Sent'),
+        (EMAIL_STATUS_FAILED, 'Failed'),
+    ]
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=1,choices=EMAIL_STATUS,default=EMAIL_STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # not picked up before this, moved forward while a worker holds it and between retries
+    send_after = models.DateTimeField(default=timezone.now)
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    datetime_sent = models.DateTimeField(null=True,blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status','send_after']),
+        ]
+        
+        
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True,default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,23 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from . import renderers
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class FastJSONParser(JSONParser):
+    '''JSONParser on top of msgspec, falls back to the stdlib parser when msgspec is not installed.'''
+    renderer_class = renderers.FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if msgspec is None:
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return msgspec.json.decode(stream.read())
+        except msgspec.DecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,216 @@
+import atexit
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from itertools import count
+
+from django.conf import settings
+
+
+MODE_SAMPLE = 'sample'
+MODE_CPROFILE = 'cprofile'
+
+
+def get_sample_rate():
+    return getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+
+
+def get_mode():
+    return getattr(settings, 'PROFILE_MODE', MODE_SAMPLE)
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_qualname}'
+
+
+class StackSampler:
+    '''
+    One daemon thread that every `interval` seconds records the collapsed stack
+    ("outer;...;inner") of each registered thread into that thread's Counter.
+    '''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.targets = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, thread_id, stacks):
+        with self.lock:
+            self.targets[thread_id] = stacks
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+                self.thread.start()
+
+    def unregister(self, thread_id):
+        with self.lock:
+            self.targets.pop(thread_id, None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            # held while sampling so a request never merges a Counter that is still being written
+            with self.lock:
+                if self.targets:
+                    self.sample()
+
+    def sample(self):
+        frames = sys._current_frames()
+        for thread_id, stacks in self.targets.items():
+            frame = frames.get(thread_id)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            if names:
+                stacks[';'.join(reversed(names))] += 1
+
+
+class Aggregate:
+    '''Rolling profile of one endpoint, written out and reset every PROFILE_FLUSH_REQUESTS samples.'''
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.lock = threading.Lock()
+        self.sequence = count(1)
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.stacks = Counter()
+        self.stats = None
+
+    def add_stacks(self, stacks):
+        with self.lock:
+            self.stacks.update(stacks)
+            self.requests += 1
+            self.flush_if_full()
+
+    def add_profile(self, profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.requests += 1
+            self.flush_if_full()
+
+    def flush_if_full(self):
+        if self.requests >= getattr(settings, 'PROFILE_FLUSH_REQUESTS', 100):
+            self.flush()
+
+    def flush(self):
+        '''Writes <tag>.<pid>.<timestamp>-<n>.collapsed and/or .pstats to PROFILE_DIR, returns the paths.'''
+        directory = settings.PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f'{self.tag}.{os.getpid()}.{time.strftime("%Y%m%d-%H%M%S")}-{next(self.sequence)}')
+        paths = []
+
+        if self.stacks:
+            paths.append(f'{base}.collapsed')
+            with open(paths[-1], 'w') as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+        if self.stats is not None:
+            paths.append(f'{base}.pstats')
+            self.stats.dump_stats(paths[-1])
+
+        self.reset()
+        return paths
+
+
+_aggregates = {}
+_aggregates_lock = threading.Lock()
+_sampler = None
+# cProfile allows one active profiler per interpreter, held by at most one request at a time
+_cprofile_lock = threading.Lock()
+
+
+def get_aggregate(tag):
+    aggregate = _aggregates.get(tag)
+    if aggregate is None:
+        with _aggregates_lock:
+            aggregate = _aggregates.setdefault(tag, Aggregate(tag))
+    return aggregate
+
+
+def get_sampler():
+    global _sampler
+    if _sampler is None:
+        with _aggregates_lock:
+            if _sampler is None:
+                _sampler = StackSampler(getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.005))
+    return _sampler
+
+
+def flush_all():
+    paths = []
+    for aggregate in list(_aggregates.values()):
+        with aggregate.lock:
+            if aggregate.requests:
+                paths += aggregate.flush()
+    return paths
+
+
+atexit.register(flush_all)
+
+
+def endpoint_tag(request):
+    '''ViewSet.action for DRF viewsets, the url name otherwise.'''
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+
+    view_class = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None)
+    if view_class is not None and actions:
+        return f'{view_class.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    return (match.view_name or match._func_path).replace(':', '.')
+
+
+def profile_calls(request, get_response):
+    '''Returns None without running the request when another request or tool already holds the profiler.'''
+    if not _cprofile_lock.acquire(blocking=False):
+        return None
+    try:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 'Another profiling tool is already active', e.g. a debugger or coverage
+            return None
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+    finally:
+        _cprofile_lock.release()
+    get_aggregate(endpoint_tag(request)).add_profile(profiler)
+    return response
+
+
+def sample_stacks(request, get_response):
+    sampler = get_sampler()
+    stacks = Counter()
+    thread_id = threading.get_ident()
+    sampler.register(thread_id, stacks)
+    try:
+        response = get_response(request)
+    finally:
+        sampler.unregister(thread_id)
+    get_aggregate(endpoint_tag(request)).add_stacks(stacks)
+    return response
+
+
+def profile(request, get_response):
+    '''In cprofile mode requests that find the profiler taken fall back to the stack sampler.'''
+    if get_mode() == MODE_CPROFILE:
+        response = profile_calls(request, get_response)
+        if response is not None:
+            return response
+    return sample_stacks(request, get_response)
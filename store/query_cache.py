@@ -0,0 +1,55 @@
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+PRODUCTS_GENERATION_KEY = 'store:generation:products'
+
+# bulk changes of more products than this bump every category instead of looking theirs up
+BULK_LOOKUP_LIMIT = 1000
+
+
+def get_timeout():
+    return settings.QUERY_CACHE_SECONDS
+
+
+def category_generation_key(category_id):
+    return f'store:generation:category:{category_id}'
+
+
+def bump_products(category_ids):
+    '''
+    Starts new generations for product listings in general and for these categories. Generations
+    are random tokens rather than numbers, so an evicted counter never comes back as an old value.
+    '''
+    keys = [PRODUCTS_GENERATION_KEY, *(category_generation_key(category_id) for category_id in set(category_ids) if category_id is not None)]
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+
+def get_generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def cache_key(params, category_id=None):
+    '''
+    params: the normalized filter, search, ordering and page values. Listings pinned to one
+    category only depend on that category's generation, so edits elsewhere keep them cached.
+    '''
+    generation_key = PRODUCTS_GENERATION_KEY if category_id is None else category_generation_key(category_id)
+    digest = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    return f'store:query:{get_generation(generation_key)}:{digest}'
+
+
+def load(key):
+    return cache.get(key)
+
+
+def save(key, ids, count, number):
+    cache.set(key, {'ids': ids, 'count': count, 'number': number}, get_timeout())
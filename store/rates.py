@@ -0,0 +1,61 @@
+import uuid
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from . import models
+
+
+RATES_VERSION_KEY = 'store:rates_version'
+
+RIAL = 'IRR'
+VAT = 'VAT'
+
+TWO_PLACES = Decimal('0.01')
+
+# what this process has loaded, replaced as a whole when the version stamp changes
+_loaded = {'version': None, 'currencies': {}, 'taxes': {}}
+
+
+def bump_version():
+    cache.set(RATES_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_version():
+    version = cache.get(RATES_VERSION_KEY)
+    if version is None:
+        cache.add(RATES_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(RATES_VERSION_KEY)
+    return version
+
+
+def get_rates():
+    '''Currency and tax rates, read from the db only after a rate changed somewhere.'''
+    global _loaded
+
+    version = get_version()
+    if _loaded['version'] != version:
+        currencies, taxes = {}, {}
+        for kind, code, value in models.Rate.objects.values_list('kind', 'code', 'value'):
+            (currencies if kind == models.Rate.RATE_KIND_CURRENCY else taxes)[code] = value
+        _loaded = {'version': version, 'currencies': currencies, 'taxes': taxes}
+
+    return _loaded
+
+
+def convert_prices(unit_prices):
+    '''
+    Converts a page of dollar prices at once, returning one dict per price with every
+    currency in the rates table plus `after_tax`.
+    '''
+    rates = get_rates()
+    currencies = list(rates['currencies'].items())
+    tax_multiplier = 1 + rates['taxes'].get(VAT, 0)
+
+    return [
+        {
+            'after_tax': (unit_price * tax_multiplier).quantize(TWO_PLACES),
+            **{code: unit_price * rate for code, rate in currencies},
+        }
+        for unit_price in unit_prices
+    ]
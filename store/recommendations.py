@@ -0,0 +1,108 @@
+import heapq
+from collections import Counter, defaultdict
+from itertools import groupby, islice
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import models
+
+
+CHUNK_SIZE = 10000
+
+
+def get_top_k():
+    return getattr(settings, 'RECOMMENDATIONS_TOP_K', 10)
+
+
+def counted_items():
+    return models.OrderItem.objects.exclude(order__status=models.Order.ORDER_STATUS_CANCELED)
+
+
+def co_occurrence(product_ids):
+    '''
+    Rows of the co-occurrence matrix for `product_ids`: {product_id: Counter({other_id: orders})}.
+    Only orders containing one of the products are streamed, grouped by order id, and each
+    basket is added to its products' rows with a single Counter.update.
+    '''
+    wanted = set(product_ids)
+    orders = counted_items().filter(product_id__in=wanted).values('order_id')
+    items = (
+        counted_items()
+        .filter(order_id__in=orders)
+        .order_by('order_id')
+        .values_list('order_id','product_id')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+    rows = defaultdict(Counter)
+    for _, basket in groupby(items, key=itemgetter(0)):
+        basket = [product_id for _, product_id in basket]
+        for product_id in wanted.intersection(basket):
+            rows[product_id].update(basket)
+
+    for product_id, row in rows.items():
+        del row[product_id]
+    return rows
+
+
+def top_neighbors(row, k):
+    # highest score first, lower product id breaks ties so reruns are stable
+    return heapq.nsmallest(k, row.items(), key=lambda item: (-item[1], item[0]))
+
+
+def write(product_ids, rows, computed_at, k):
+    recommendations = [
+        models.ProductRecommendation(
+            product_id=product_id,
+            recommended_id=recommended_id,
+            rank=rank,
+            score=score,
+            datetime_computed=computed_at,
+        )
+        for product_id in product_ids
+        for rank, (recommended_id, score) in enumerate(top_neighbors(rows.get(product_id, {}), k), 1)
+    ]
+    with transaction.atomic():
+        models.ProductRecommendation.objects.filter(product_id__in=product_ids).delete()
+        models.ProductRecommendation.objects.bulk_create(recommendations, batch_size=1000)
+    return len(recommendations)
+
+
+def batches(ids, size):
+    ids = iter(ids)
+    while batch := list(islice(ids, size)):
+        yield batch
+
+
+def rebuild(product_ids, block_size=500, k=None):
+    '''Recomputes the top-k neighbors of `product_ids`, `block_size` matrix rows at a time.'''
+    k = k or get_top_k()
+    computed_at = timezone.now()
+    products = written = 0
+    for block in batches(product_ids, block_size):
+        written += write(block, co_occurrence(block), computed_at, k)
+        products += len(block)
+        yield products, written
+
+
+def all_product_ids():
+    return models.Product.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=CHUNK_SIZE)
+
+
+def last_computed():
+    return models.ProductRecommendation.objects.aggregate(last=Max('datetime_computed'))['last']
+
+
+def changed_product_ids(since):
+    '''Products in orders placed since `since`, their rows are the only ones a new basket changes.'''
+    return (
+        counted_items()
+        .filter(order__datetime_created__gte=since)
+        .order_by('product_id')
+        .values_list('product_id', flat=True)
+        .distinct()
+    )
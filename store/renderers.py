@@ -0,0 +1,68 @@
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def enc_hook(obj):
+    # Decimal, UUID, date and datetime are encoded natively, only the rare leftovers come here
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    # msgspec does not encode str subclasses such as ErrorDetail
+    if isinstance(obj, str):
+        return str(obj)
+    return JSONEncoder().default(obj)
+
+
+if msgspec is not None:
+    encoder = msgspec.json.Encoder(enc_hook=enc_hook, decimal_format='number')
+
+
+class FastJSONRenderer(JSONRenderer):
+    '''
+    JSONRenderer on top of msgspec, falls back to the stdlib renderer when msgspec
+    is not installed. Decimals are written as numbers, like COERCE_DECIMAL_TO_STRING=False.
+    '''
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if msgspec is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if data is None:
+            return b''
+
+        ret = encoder.encode(data)
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent:
+            ret = msgspec.json.format(ret, indent=indent)
+
+        # same javascript-safe escaping as JSONRenderer
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class NDJSONRenderer(FastJSONRenderer):
+    '''
+    Newline delimited JSON for list endpoints (?format=ndjson), one object per line.
+    Paginated responses only write their results.
+    '''
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if isinstance(data, dict) and isinstance(data.get('results'), list):
+            data = data['results']
+        if not isinstance(data, list):
+            data = [data]
+
+        return b''.join(super(NDJSONRenderer, self).render(obj) + b'\n' for obj in data)
@@ -0,0 +1,83 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+PIN_COOKIE_NAME = 'pin_primary'
+PIN_COOKIE_SALT = 'store.replicas.pin'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def get_pin_seconds():
+    return getattr(settings, 'PRIMARY_PIN_SECONDS', 5)
+
+
+def _pin_key(user_id):
+    return f'store:primary_pin:{user_id}'
+
+
+def pin_to_primary(request, response):
+    '''
+    Keeps the writer on the primary for PRIMARY_PIN_SECONDS so its next reads see the write.
+    The signed cookie works whichever worker serves the next request. The per-user pin covers
+    JWT clients that drop cookies, and it only reaches other workers when CACHES is shared.
+    '''
+    expires = time.time() + get_pin_seconds()
+    response.set_signed_cookie(
+        PIN_COOKIE_NAME, str(expires), salt=PIN_COOKIE_SALT, max_age=get_pin_seconds(), httponly=True
+    )
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        cache.set(_pin_key(user.id), expires, get_pin_seconds())
+
+
+def is_pinned_to_primary(request):
+    if request.get_signed_cookie(PIN_COOKIE_NAME, None, salt=PIN_COOKIE_SALT, max_age=get_pin_seconds()):
+        return True
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return cache.get(_pin_key(user.id), 0) > time.time()
+    return False
+
+
+def allow_replica_reads(allowed=True):
+    return _replica_reads.set(allowed)
+
+
+def reset_replica_reads(token):
+    _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    '''
+    Sends reads to a random replica only while a read-only catalog view has allowed it,
+    the connection is not inside a transaction and the user is not pinned to the primary.
+    Everything else, including all writes, stays on the primary.
+    '''
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or not _replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
@@ -0,0 +1,63 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import urlencode
+
+from . import rates
+
+
+CATALOG_VERSION_KEY = 'store:catalog_version'
+
+
+def get_timeout():
+    return settings.RESPONSE_CACHE_SECONDS
+
+
+def bump_version():
+    cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def cache_key(request):
+    '''
+    Absolute URL with sorted query parameters, under the catalog and rates versions
+    so any product, category or rate change starts a fresh key space.
+    '''
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    url = f'{request.scheme}://{request.get_host()}{request.path}?{query}'
+    digest = hashlib.md5(url.encode()).hexdigest()
+    return f'store:response:{get_version()}:{rates.get_version()}:{digest}'
+
+
+def object_keys(name, ids):
+    prefix = f'store:object:{get_version()}:{rates.get_version()}:{name}'
+    return {object_id: f'{prefix}:{object_id}' for object_id in ids}
+
+
+def load_objects(name, ids):
+    '''Cached representations of `ids` as {id: data}, misses are left out.'''
+    keys = object_keys(name, ids)
+    found = cache.get_many(keys.values())
+    return {object_id: found[key] for object_id, key in keys.items() if key in found}
+
+
+def save_objects(name, objects):
+    keys = object_keys(name, objects)
+    cache.set_many({keys[object_id]: data for object_id, data in objects.items()}, get_timeout())
+
+
+def load(request):
+    return cache.get(cache_key(request))
+
+
+def save(request, data):
+    cache.set(cache_key(request), data, get_timeout())
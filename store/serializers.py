@@ -1,14 +1,78 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.utils.text import slugify 
 from django.db import transaction 
-from decimal import Decimal
+from django.db.models import Prefetch
 
 
 from . import models
+from . import rates
+from . import bulk_edit
+from . import inventory
+from .loaders import BatchLoadingListSerializer, BatchLoadingMixin
 
 
 
-DOLLORS_TO_RIALS = 500000
+class QueryFieldsMixin:
+    '''
+    `?fields=a,b` keeps only those fields, `?expand=rel` adds relation fields back in.
+    Without either parameter every field is returned as before.
+    `query_fields` maps a field to what it needs from the database
+    ({'only': [...], 'select_related': [...], 'prefetch_related': [...]}), fields that are
+    not listed load their own source. Fields with relations are the expandable ones.
+    '''
+    query_fields = {}
+    
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        
+        requested = self.get_requested_fields(self.context.get('request'))
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+    
+    @classmethod
+    def get_expandable_fields(cls):
+        return {
+            name for name, needs in cls.query_fields.items()
+            if needs.get('select_related') or needs.get('prefetch_related')
+        }
+    
+    @classmethod
+    def get_requested_fields(cls,request):
+        query_params = getattr(request,'query_params',None)
+        if query_params is None or ('fields' not in query_params and 'expand' not in query_params):
+            return None
+        
+        available = set(cls._declared_fields)
+        expand = {name for name in query_params.get('expand','').split(',') if name}
+        if 'fields' in query_params:
+            requested = {name for name in query_params['fields'].split(',') if name}
+        else:
+            requested = available - cls.get_expandable_fields()
+        
+        return (requested | expand) & available
+    
+    @classmethod
+    def optimize_queryset(cls,queryset,request):
+        requested = cls.get_requested_fields(request)
+        if requested is None:
+            return queryset
+        
+        only, select_related, prefetch_related = {'pk'}, [], []
+        for name in requested:
+            needs = cls.query_fields.get(name,{'only': [cls._declared_fields[name].source or name]})
+            only.update(needs.get('only',[]))
+            select_related += needs.get('select_related',[])
+            prefetch_related += needs.get('prefetch_related',[])
+        
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset.only(*only)
 
 
 class CategorySerializer(serializers.Serializer):
@@ -22,11 +86,37 @@ class CategorySerializer(serializers.Serializer):
     num_of_products = serializers.IntegerField(source='products.count',read_only=True)
     
 
+class AnnotatedCategorySerializer(CategorySerializer):
+    '''Reads the product count from a `products_count` annotation instead of a query per category.'''
+    num_of_products = serializers.IntegerField(source='products_count',read_only=True)
+    
+
 
-class ProductSerializer(serializers.Serializer):
+class ProductListSerializer(serializers.ListSerializer):
+    '''Converts the prices and sums the sharded stock of the whole page in one go before the rows are serialized.'''
+    
+    def to_representation(self, data):
+        instances = list(data.all() if hasattr(data,'all') else data)
+        
+        if 'inventory' in self.child.fields:
+            inventory.load_stock(instances)
+        
+        if self.child.PRICE_FIELDS & set(self.child.fields):
+            converted = rates.convert_prices([product.unit_price for product in instances])
+            self.child.converted_prices = {
+                product.pk: prices for product, prices in zip(instances,converted)
+            }
+        return super().to_representation(instances)
+    
+    
+class ProductSerializer(QueryFieldsMixin,serializers.Serializer):
     class Meta:
         model = models.Product
         fields = ['id', 'name', 'unit_price', 'inventory', 'category', 'price_to_rial', 'price_after_tax', 'slug', 'description']
+        list_serializer_class = ProductListSerializer
+    
+    PRICE_FIELDS = {'price_to_rial','price_after_tax'}
+    converted_prices = {}
         
     id = serializers.IntegerField()
     inventory = serializers.IntegerField()
@@ -41,11 +131,30 @@ class ProductSerializer(serializers.Serializer):
     price_to_rial = serializers.SerializerMethodField()
     price_after_tax = serializers.SerializerMethodField()
     
+    query_fields = {
+        'price_to_rial': {'only': ['unit_price']},
+        'price_after_tax': {'only': ['unit_price']},
+        'inventory': {'only': ['inventory','inventory_shard_count']},
+    }
+    
+    def to_representation(self,product):
+        data = super().to_representation(product)
+        if 'inventory' in data and isinstance(product,models.Product):
+            data['inventory'] = inventory.load_stock([product])[0].stock
+        return data
+    
+    def get_prices(self,product:models.Product):
+        prices = self.converted_prices.get(product.pk)
+        if prices is None:
+            prices = rates.convert_prices([product.unit_price])[0]
+        return prices
+    
     def get_price_to_rial(self,product:models.Product):
-        return int(product.unit_price * DOLLORS_TO_RIALS)
+        rial = self.get_prices(product).get(rates.RIAL)
+        return int(rial) if rial is not None else None
     
     def get_price_after_tax(self,product:models.Product):
-        return round(product.unit_price * Decimal(1.09), 2)
+        return self.get_prices(product)['after_tax']
     
     def validate(self, data):
         if len(data['name']) < 6 :
@@ -58,6 +167,72 @@ class ProductSerializer(serializers.Serializer):
         product.save()
         return product
     
+
+class AdjustmentSerializer(serializers.Serializer):
+    mode = serializers.ChoiceField(choices=bulk_edit.MODES)
+    value = serializers.DecimalField(max_digits=10,decimal_places=2)
+    
+    
+class PriceListRowSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    unit_price = serializers.DecimalField(max_digits=6,decimal_places=2,min_value=Decimal('0'),required=False)
+    inventory = serializers.IntegerField(min_value=0,required=False)
+    
+    
+class ProductBulkEditSerializer(serializers.Serializer):
+    '''
+    Either adjustments (unit_price and/or inventory) for the selected `products` or a whole
+    `category`, or a `price_list` of rows with absolute values.
+    '''
+    MAX_PRICE_LIST_ROWS = 10000
+    
+    products = serializers.ListField(child=serializers.IntegerField(),required=False,allow_empty=False)
+    category = serializers.PrimaryKeyRelatedField(queryset=models.Category.objects.all(),required=False)
+    unit_price = AdjustmentSerializer(required=False)
+    inventory = AdjustmentSerializer(required=False)
+    price_list = PriceListRowSerializer(many=True,required=False,allow_empty=False)
+    
+    def validate_price_list(self,rows):
+        if len(rows) > self.MAX_PRICE_LIST_ROWS:
+            raise serializers.ValidationError(f'At most {self.MAX_PRICE_LIST_ROWS} rows can be applied at once.')
+        if len({row['id'] for row in rows}) != len(rows):
+            raise serializers.ValidationError('Each product can only appear once.')
+        if any(len(row) == 1 for row in rows):
+            raise serializers.ValidationError('Each row needs a unit_price or an inventory.')
+        return rows
+    
+    def validate(self,data):
+        adjustments = {field for field in bulk_edit.FIELDS if field in data}
+        selection = {'products','category'} & set(data)
+        
+        if 'price_list' in data:
+            if adjustments or selection:
+                raise serializers.ValidationError('price_list cannot be combined with adjustments.')
+        elif not adjustments:
+            raise serializers.ValidationError('Give a unit_price or inventory adjustment, or a price_list.')
+        elif len(selection) != 1:
+            raise serializers.ValidationError('Select either products or a category to adjust.')
+        else:
+            if 'category' in data:
+                data['products'] = list(data.pop('category').products.values_list('id',flat=True))
+            too_large = bulk_edit.out_of_range(data['products'],self.get_adjustments(data))
+            if too_large:
+                raise serializers.ValidationError({
+                    field: f'The adjusted value would exceed {bulk_edit.MAX_VALUES[field]} for some products.' for field in too_large
+                })
+        return data
+    
+    def get_adjustments(self,data):
+        return {
+            field: (data[field]['mode'],data[field]['value']) for field in bulk_edit.FIELDS if field in data
+        }
+    
+    def save(self,**kwargs):
+        data = self.validated_data
+        if 'price_list' in data:
+            return bulk_edit.apply_price_list({row.pop('id'): row for row in data['price_list']})
+        return bulk_edit.adjust(data['products'],self.get_adjustments(data))
+    
  
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -123,10 +298,11 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
     
     
     
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(BatchLoadingMixin,serializers.ModelSerializer):
     class Meta:
         model = models.CartItem
         fields = ['id','product','quantity','product','item_total']
+        list_serializer_class = BatchLoadingListSerializer
         
     id = serializers.IntegerField()
     product = serializers.CharField(max_length=255)
@@ -139,11 +315,12 @@ class CartItemSerializer(serializers.ModelSerializer):
         
     
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(BatchLoadingMixin,serializers.ModelSerializer):
     class Meta:
         model = models.Cart
-        fields = ['id','created_at','items']  
+        fields = ['id','created_at','items','total_price']  
         read_only_fields = ['id','items']
+        list_serializer_class = BatchLoadingListSerializer
         
     id = serializers.UUIDField(read_only=True)  
     created_at = serializers.DateTimeField()
@@ -168,16 +345,31 @@ class OrderCustomersSerializer(serializers.ModelSerializer):
     
     
     
+class CustomerStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.CustomerStats
+        fields = ['order_count','lifetime_spend','last_order_at']
+    
+    
+    
 class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Customer
-        fields = ['id','user','birth_date',]
+        fields = ['id','user','birth_date','stats']
         read_only_fields = ['user']
         
         
     id = serializers.IntegerField()
     user = serializers.CharField(max_length=255)
     birth_date = serializers.DateField()
+    # null until the customer's first order
+    stats = CustomerStatsSerializer(read_only=True)
+    
+    
+    
+class EmailSerializer(serializers.Serializer):
+    subject = serializers.CharField(max_length=255)
+    body = serializers.CharField()
     
     
     
@@ -193,31 +385,61 @@ class OrderItemProductSerializer(serializers.ModelSerializer):
     
     
     
+class ProductRecommendationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.ProductRecommendation
+        fields = ['id','name','unit_price','score']
+        
+        
+    id = serializers.IntegerField(source='recommended_id')
+    name = serializers.CharField(source='recommended.name')
+    unit_price = serializers.DecimalField(source='recommended.unit_price',max_digits=6,decimal_places=2)
+    
+    
+    
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.OrderItem
-        fields = ['id','product','quantity','unit_price']
+        fields = ['id','product','quantity','unit_price','discount']
         
     
     id = serializers.IntegerField()
     product = OrderItemProductSerializer()
     quantity = serializers.IntegerField()
     unit_price = serializers.IntegerField()
+    discount = serializers.DecimalField(max_digits=10,decimal_places=2)
     
     
 
-class OrderForAdminSerializer(serializers.ModelSerializer):
+ORDER_ITEMS_PREFETCH = Prefetch('items',queryset=models.OrderItem.objects.select_related('product'))
+
+
+class OrderForAdminSerializer(QueryFieldsMixin,BatchLoadingMixin,serializers.ModelSerializer):
     class Meta:
         model = models.Order
-        fields = ['id','customer_id','status','datetime_created','items','customer']
+        fields = ['id','customer_id','status','datetime_created','item_count','subtotal','discount','total','items','customer']
+        list_serializer_class = BatchLoadingListSerializer
     
     
     id = serializers.IntegerField()
     customer_id = serializers.CharField(max_length=255)
     status = serializers.CharField(max_length=1)
     datetime_created = serializers.DateTimeField()
-    items = OrderItemSerializer()   
+    item_count = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12,decimal_places=2)
+    discount = serializers.DecimalField(max_digits=12,decimal_places=2)
+    total = serializers.DecimalField(max_digits=12,decimal_places=2)
+    items = OrderItemSerializer(many=True)   
     customer = OrderCustomersSerializer() 
+    
+    query_fields = {
+        'customer_id': {'only': ['customer']},
+        'items': {'prefetch_related': [ORDER_ITEMS_PREFETCH]},
+        'customer': {
+            'only': ['customer__id','customer__user__first_name','customer__user__last_name','customer__user__email'],
+            'select_related': ['customer__user'],
+        },
+    }
 
 
 
@@ -241,9 +463,14 @@ class OrderCreateSerializer(serializers.Serializer):
             
             order = models.Order()
             order.customer = customer
-            order.save()
             
-            cart_items = models.CartItem.objects.select_related('product').filter(cart_id=cart_id)
+            cart_items = models.CartItem.objects.select_related('product').filter(cart_id=cart_id).order_by('product_id')
+            
+            # in product order so concurrent checkouts lock stock rows in the same order
+            for cart_item in cart_items:
+                if not inventory.take(cart_item.product,cart_item.quantity):
+                    raise serializers.ValidationError({'cart_id': f'There is not enough inventory of {cart_item.product.name}.'})
+            inventory.announce_sold_out(cart_item.product_id for cart_item in cart_items)
             
             order_items = [
                 models.OrderItem(
@@ -253,32 +480,83 @@ class OrderCreateSerializer(serializers.Serializer):
                     quantity=cart_item.quantity,
                 ) for cart_item in cart_items
             ]
-        
+            
+            # totals come from the items in hand, the order row is written once
+            order.set_totals(order_items)
+            order.save()
             models.OrderItem.objects.bulk_create(order_items)
             models.Cart.objects.get(pk=cart_id).delete()
             
             return order 
         
 
+class OrderDateRangeSerializer(serializers.Serializer):
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    
+    
+    
+class OrderStatusChangeSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=models.Order.ORDER_STATUS)
+    
+    
+class OrderBulkStatusSerializer(serializers.Serializer):
+    MAX_ORDERS = 5000
+    
+    orders = OrderStatusChangeSerializer(many=True,allow_empty=False)
+    
+    def validate_orders(self,orders):
+        if len(orders) > self.MAX_ORDERS:
+            raise serializers.ValidationError(f'At most {self.MAX_ORDERS} orders can be changed at once.')
+        if len({order['id'] for order in orders}) != len(orders):
+            raise serializers.ValidationError('Each order can only appear once.')
+        return orders
+    
+    def save(self,**kwargs):
+        results = models.Order.objects.bulk_transition(
+            {order['id']: order['status'] for order in self.validated_data['orders']}
+        )
+        return [{'id': order_id, **result} for order_id, result in results.items()]
+    
+    
 class OrderUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Order 
         fields = ['status']
         
-    status = serializers.CharField(max_length=1)
+    status = serializers.ChoiceField(choices=models.Order.ORDER_STATUS)
+    
+    def update(self,instance,validated_data):
+        # through bulk_transition, so a PATCH obeys ALLOWED_STATUS_TRANSITIONS under the same row lock as bulk_status
+        result = models.Order.objects.bulk_transition({instance.pk: validated_data['status']})[instance.pk]
+        if result['error'] is not None:
+            raise serializers.ValidationError({'status': result['error']})
+        instance.status = validated_data['status']
+        return instance
     
     
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(QueryFieldsMixin,BatchLoadingMixin,serializers.ModelSerializer):
     class Meta:
         model = models.Order
-        fields = ['id','customer_id','status','datetime_created','items']
+        fields = ['id','customer_id','status','datetime_created','item_count','subtotal','discount','total','items']
+        list_serializer_class = BatchLoadingListSerializer
     
     
     id = serializers.IntegerField()
     customer_id = serializers.CharField(max_length=255)
     status = serializers.CharField(max_length=1)
     datetime_created = serializers.DateTimeField()
-    items = OrderItemSerializer()
+    item_count = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12,decimal_places=2)
+    discount = serializers.DecimalField(max_digits=12,decimal_places=2)
+    total = serializers.DecimalField(max_digits=12,decimal_places=2)
+    items = OrderItemSerializer(many=True)
+    
+    query_fields = {
+        'customer_id': {'only': ['customer']},
+        'items': {'prefetch_related': [ORDER_ITEMS_PREFETCH]},
+    }
    
    
    
@@ -3,3 +3,12 @@ from django.dispatch import Signal
 
 order_ceated = Signal()
 
+# sent inside the updating transaction with changes=[(order_id, old_status, new_status), ...]
+order_status_changed = Signal()
+
+# sent inside the updating transaction by Order.update_totals with order and old_total
+order_total_changed = Signal()
+
+# sent once after a bulk price or inventory edit, a checkout or an inventory clear with product_ids=[...]
+products_bulk_changed = Signal()
+
@@ -1,11 +1,140 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver 
 from django.conf import settings 
 
 from store import models
+from store import rates
+from store import autocomplete
+from store import response_cache
+from store import changes
+from store import customer_stats
+from store import query_cache
+from store.signals import order_status_changed, order_total_changed, products_bulk_changed
 
 
 @receiver(post_save,sender=settings.AUTH_USER_MODEL)
 def create_customer_profile_for_newly_created_user(sender,created,instance,**kwargs):
     if created :
         models.Customer.objects.create(user=instance)
+
+
+@receiver([post_save,post_delete],sender=models.Rate)
+def bump_rates_version(sender,**kwargs):
+    # after commit, or another worker could reload the old rows under the new version
+    transaction.on_commit(rates.bump_version)
+
+
+@receiver(post_save,sender=models.Product)
+@receiver(post_save,sender=models.Category)
+def update_autocomplete_index(sender,instance,**kwargs):
+    kind = autocomplete.PRODUCTS if sender is models.Product else autocomplete.CATEGORIES
+    text = instance.name if sender is models.Product else instance.title
+    if autocomplete.index.built or autocomplete.index.loading:
+        transaction.on_commit(lambda: autocomplete.index.update(kind,instance.pk,text))
+
+
+@receiver(post_delete,sender=models.Product)
+@receiver(post_delete,sender=models.Category)
+def remove_from_autocomplete_index(sender,instance,**kwargs):
+    kind = autocomplete.PRODUCTS if sender is models.Product else autocomplete.CATEGORIES
+    pk = instance.pk
+    if autocomplete.index.built or autocomplete.index.loading:
+        transaction.on_commit(lambda: autocomplete.index.remove(kind,pk))
+
+
+@receiver([post_save,post_delete],sender=models.Product)
+@receiver([post_save,post_delete],sender=models.Category)
+@receiver(products_bulk_changed)
+def bump_catalog_version(sender,**kwargs):
+    # after commit, or another worker could cache the old rows under the new version
+    transaction.on_commit(response_cache.bump_version)
+
+
+@receiver(pre_save,sender=models.Product)
+def remember_product_category(sender,instance,**kwargs):
+    # a product moving away also changes its old category's listings
+    if instance.pk is not None:
+        instance._old_category_id = models.Product.objects.filter(pk=instance.pk).values_list('category_id',flat=True).first()
+
+
+@receiver([post_save,post_delete],sender=models.Product)
+def bump_product_generations(sender,instance,**kwargs):
+    # generations move after commit like the catalog version
+    category_ids = [instance.category_id,getattr(instance,'_old_category_id',None)]
+    transaction.on_commit(lambda: query_cache.bump_products(category_ids))
+
+
+@receiver([post_save,post_delete],sender=models.Category)
+def bump_category_generation(sender,instance,**kwargs):
+    # search matches category titles
+    category_id = instance.pk
+    transaction.on_commit(lambda: query_cache.bump_products([category_id]))
+
+
+@receiver(products_bulk_changed)
+def bump_bulk_changed_generations(sender,product_ids,**kwargs):
+    # categories are few, looking them all up beats an IN list of a whole catalog
+    if len(product_ids) > query_cache.BULK_LOOKUP_LIMIT:
+        category_ids = list(models.Category.objects.values_list('id',flat=True))
+    else:
+        category_ids = list(models.Product.objects.filter(id__in=product_ids).values_list('category_id',flat=True).distinct())
+    transaction.on_commit(lambda: query_cache.bump_products(category_ids))
+
+
+@receiver(post_save,sender=models.Product)
+def log_product_saved(sender,instance,created,**kwargs):
+    old_category_id = getattr(instance,'_old_category_id',None)
+    if created or old_category_id != instance.category_id:
+        # products_count changes in the new category and, for a move, the old one
+        changes.record((changes.PRODUCT,instance.pk),(changes.CATEGORY,instance.category_id),(changes.CATEGORY,old_category_id))
+    else:
+        changes.record((changes.PRODUCT,instance.pk))
+
+
+@receiver(post_delete,sender=models.Product)
+def log_product_deleted(sender,instance,**kwargs):
+    changes.record((changes.PRODUCT,instance.pk),(changes.CATEGORY,instance.category_id))
+
+
+@receiver([post_save,post_delete],sender=models.Category)
+def log_category_change(sender,instance,**kwargs):
+    changes.record((changes.CATEGORY,instance.pk))
+
+
+@receiver(m2m_changed,sender=models.Product.discount.through)
+def log_product_discounts_changed(sender,instance,action,reverse,pk_set,**kwargs):
+    if action == 'pre_clear' and reverse:
+        # the cleared products are gone by post_clear
+        instance._cleared_product_ids = list(instance.products.values_list('id',flat=True))
+    elif action in ('post_add','post_remove','post_clear'):
+        if not reverse:
+            product_ids = [instance.pk]
+        elif action == 'post_clear':
+            product_ids = getattr(instance,'_cleared_product_ids',[])
+        else:
+            product_ids = pk_set
+        changes.record(*((changes.PRODUCT,product_id) for product_id in product_ids))
+
+
+@receiver(post_save,sender=models.Discount)
+@receiver(pre_delete,sender=models.Discount)
+def log_discount_products(sender,instance,**kwargs):
+    changes.record(*((changes.PRODUCT,product_id) for product_id in instance.products.values_list('id',flat=True)))
+
+
+@receiver(post_save,sender=models.Order)
+def count_new_order(sender,instance,created,**kwargs):
+    # every way of creating an order, so later status changes always find the customer's row
+    if created:
+        customer_stats.record_order(instance)
+
+
+@receiver(order_status_changed)
+def update_customer_stats(sender,changes,**kwargs):
+    customer_stats.record_status_changes(changes)
+
+
+@receiver(order_total_changed)
+def update_customer_spend(sender,order,old_total,**kwargs):
+    customer_stats.record_total_change(order,old_total)
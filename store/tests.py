@@ -1,3 +1,992 @@
-from django.test import TestCase
+import cProfile
+import io
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.core import mail as outbox
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import serializers as drf_serializers
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import autocomplete
+from . import bulk_edit
+from . import changes
+from . import checks
+from . import customer_stats
+from . import idempotency
+from . import inventory
+from . import loaders
+from . import mail
+from . import middleware
+from . import models
+from . import parsers
+from . import profiling
+from . import query_cache
+from . import rates
+from . import renderers
+from . import replicas
+from . import response_cache
+from . import serializers
+from . import throttling
+from . import user_import
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = replicas.PrimaryReplicaRouter()
+
+    def test_reads_stay_on_primary_unless_allowed(self):
+        self.assertEqual(self.router.db_for_read(models.Product), 'default')
+        token = replicas.allow_replica_reads()
+        try:
+            self.assertEqual(self.router.db_for_read(models.Product), 'replica')
+        finally:
+            replicas.reset_replica_reads(token)
+
+    def test_writes_go_to_primary(self):
+        token = replicas.allow_replica_reads()
+        try:
+            self.assertEqual(self.router.db_for_write(models.Product), 'default')
+        finally:
+            replicas.reset_replica_reads(token)
+
+    def product_on(self, alias):
+        product = models.Product()
+        product._state.db = alias
+        return product
+
+    def test_allow_relation(self):
+        self.assertIs(self.router.allow_relation(self.product_on('default'), self.product_on('replica')), True)
+        # no opinion, other routers or Django's default decide
+        self.assertIsNone(self.router.allow_relation(self.product_on('replica'), self.product_on('other')))
+
+
+class PrimaryPinTests(SimpleTestCase):
+    def pinned_request(self, cookie_value=None):
+        request = RequestFactory().get('/store/products/')
+        if cookie_value is not None:
+            request.COOKIES[replicas.PIN_COOKIE_NAME] = cookie_value
+        return request
+
+    def test_signed_cookie_pins_any_worker(self):
+        response = HttpResponse()
+        replicas.pin_to_primary(RequestFactory().post('/store/products/'), response)
+        cookie = response.cookies[replicas.PIN_COOKIE_NAME].value
+        self.assertTrue(replicas.is_pinned_to_primary(self.pinned_request(cookie)))
+
+    def test_unsigned_cookie_is_ignored(self):
+        self.assertFalse(replicas.is_pinned_to_primary(self.pinned_request('1')))
+        self.assertFalse(replicas.is_pinned_to_primary(self.pinned_request()))
+
+
+@skipUnless('replica' in settings.DATABASES, "needs a 'replica' alias in DATABASES without TEST MIRROR, e.g. two SQLite files")
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaReadsTests(TransactionTestCase):
+    '''The replica test database is separate and never receives the writes, like a lagging replica.'''
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def test_catalog_reads_use_replica_until_pinned(self):
+        models.Category.objects.create(title='only on primary')
+        self.assertEqual(models.Category.objects.using('replica').count(), 0)
+
+        response = self.client.get('/store/categories/', HTTP_ACCEPT='application/json')
+        self.assertNotContains(response, 'only on primary')
+
+        pin = HttpResponse()
+        replicas.pin_to_primary(RequestFactory().post('/store/categories/'), pin)
+        self.client.cookies.update(pin.cookies)
+        response = self.client.get('/store/categories/', HTTP_ACCEPT='application/json')
+        self.assertContains(response, 'only on primary')
+
+    def test_transactions_read_from_primary(self):
+        token = replicas.allow_replica_reads()
+        try:
+            with transaction.atomic():
+                models.Category.objects.create(title='in transaction')
+                self.assertTrue(models.Category.objects.filter(title='in transaction').exists())
+        finally:
+            replicas.reset_replica_reads(token)
+
+
+class FixedKeyThrottle(throttling.TokenBucketThrottle):
+    rate = '5/min'
+
+    def get_cache_key(self, request, view):
+        return 'throttle_test'
+
+
+def run_threads(target, count=20):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(target())) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@override_settings(THROTTLE_STORAGE='cache', CHECKOUT_CONCURRENCY_LIMIT=3)
+class SharedThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_requests_do_not_overshoot_the_rate(self):
+        results = run_threads(lambda: FixedKeyThrottle().allow_request(None, None))
+        self.assertEqual(results.count(True), 5)
+
+    def test_slow_request_keeps_its_hands_off_a_lock_taken_after_expiry(self):
+        lock_key = 'throttle_test:lock'
+        second_holds_lock = threading.Event()
+        first_done = threading.Event()
+
+        class SlowThrottle(FixedKeyThrottle):
+            def update_arrival_time(self):
+                if threading.current_thread().name == 'first':
+                    time.sleep(1.2)
+                else:
+                    second_holds_lock.set()
+                    first_done.wait(5)
+                return super().update_arrival_time()
+
+        with mock.patch.object(throttling, '_LOCK_TIMEOUT', 1), mock.patch.object(throttling, '_LOCK_ATTEMPTS', 1000):
+            first = threading.Thread(target=SlowThrottle().allow_request, args=(None, None), name='first')
+            first.start()
+            time.sleep(0.1)
+            second = threading.Thread(target=SlowThrottle().allow_request, args=(None, None), name='second')
+            second.start()
+            # the second request only gets the lock once the first one's expired
+            self.assertTrue(second_holds_lock.wait(5))
+            first.join()
+            self.assertIsNotNone(cache.get(lock_key))
+            first_done.set()
+            second.join()
+        self.assertIsNone(cache.get(lock_key))
+
+    def test_concurrency_slots_are_leased_and_returned(self):
+        barrier = threading.Barrier(3)
+        limiter = throttling.ConcurrencyLimiter('test', 'CHECKOUT_CONCURRENCY_LIMIT', default_limit=3)
+
+        def hold_slot():
+            try:
+                with limiter():
+                    barrier.wait(timeout=5)
+                    return True
+            except throttling.Overloaded:
+                return False
+
+        self.assertEqual(run_threads(hold_slot, 3).count(True), 3)
+        # all slots were given back
+        self.assertEqual(run_threads(hold_slot, 3).count(True), 3)
+
+    def test_full_limiter_sheds_load_and_slots_expire(self):
+        limiter = throttling.ConcurrencyLimiter('test', 'CHECKOUT_CONCURRENCY_LIMIT', default_limit=3, slot_timeout=1)
+        for slot in range(3):
+            # leases of a worker that died without releasing them
+            cache.add(f'concurrency_test:{slot}', 1, 1)
+        with self.assertRaises(throttling.Overloaded):
+            with limiter():
+                pass
+        time.sleep(1.1)
+        with limiter():
+            pass
+
+
+class RatesVersionTests(TestCase):
+    def test_version_changes_only_after_commit(self):
+        version = rates.get_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            models.Rate.objects.create(kind=models.Rate.RATE_KIND_CURRENCY, code='EUR', value=2)
+            self.assertEqual(rates.get_version(), version)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotEqual(rates.get_version(), version)
+        self.assertIn('EUR', rates.get_rates()['currencies'])
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    @override_settings(DEBUG=False)
+    def test_process_local_cache_warns(self):
+        self.assertEqual([warning.id for warning in checks.check_shared_cache(None)], ['store.W001'])
+
+    @override_settings(DEBUG=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost'}})
+    def test_shared_cache_passes(self):
+        self.assertEqual(checks.check_shared_cache(None), [])
+
+
+class AutocompleteLoadingTests(SimpleTestCase):
+    def test_searches_and_changes_do_not_wait_for_the_build(self):
+        index = autocomplete.PrefixIndex()
+        release = threading.Event()
+
+        def items():
+            yield autocomplete.PRODUCTS, 1, 'Black tea'
+            release.wait(5)
+            yield autocomplete.PRODUCTS, 2, 'Green tea'
+
+        builder = threading.Thread(target=index.build, args=(items(),))
+        builder.start()
+        while not index.loading:
+            time.sleep(0.001)
+        self.assertEqual(index.search('tea')[autocomplete.PRODUCTS], [])
+        index.update(autocomplete.PRODUCTS, 3, 'Tea cups')
+        index.remove(autocomplete.PRODUCTS, 1)
+        release.set()
+        builder.join()
+
+        self.assertFalse(index.loading)
+        found = index.search('tea')[autocomplete.PRODUCTS]
+        self.assertEqual(sorted(item['id'] for item in found), [2, 3])
+
+
+class CatalogVersionTests(TestCase):
+    def test_version_changes_only_after_commit(self):
+        version = response_cache.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Category.objects.create(title='Tea')
+            self.assertEqual(response_cache.get_version(), version)
+        self.assertNotEqual(response_cache.get_version(), version)
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.tea = models.Category.objects.create(title='Tea')
+        self.coffee = models.Category.objects.create(title='Coffee')
+        self.product = models.Product.objects.create(
+            name='Black tea', description='', category=self.tea, unit_price=5, slug='black-tea', inventory=10,
+        )
+
+    def logged(self):
+        return list(models.CatalogChange.objects.order_by('id').values_list('kind', 'object_id'))
+
+    def test_entries_are_written_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Breakfast tea'
+            self.product.save()
+            self.assertEqual(self.logged(), [])
+        self.assertEqual(self.logged(), [(changes.PRODUCT, self.product.pk)])
+
+    def test_moving_a_product_logs_both_categories(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.category = self.coffee
+            self.product.save()
+        self.assertCountEqual(self.logged(), [
+            (changes.PRODUCT, self.product.pk), (changes.CATEGORY, self.coffee.pk), (changes.CATEGORY, self.tea.pk),
+        ])
+        changed, cursor, has_more = changes.read(0, 10)
+        self.assertEqual(changed, {changes.PRODUCT: set(), changes.CATEGORY: set()})
+        self.assertTrue(has_more)
+
+
+class ProductBatchTests(TestCase):
+    def test_sparse_fields_without_id(self):
+        category = models.Category.objects.create(title='Tea')
+        product = models.Product.objects.create(
+            name='Black tea', description='', category=category, unit_price=5, slug='black-tea', inventory=10,
+        )
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = client.get(reverse('product-batch'), {'ids': f'{product.pk},999999', 'fields': 'name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'results': [{'name': 'Black tea'}], 'missing': [999999]})
+
+
+class ProductDeleteTests(TestCase):
+    def test_product_in_archived_orders_is_kept(self):
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = models.Category.objects.create(title='Tea')
+        product = models.Product.objects.create(
+            name='Black tea', description='', category=category, unit_price=5, slug='black-tea', inventory=10,
+        )
+        order = models.ArchivedOrder.objects.create(
+            id=1, customer=admin.customer, status=models.Order.ORDER_STATUS_PAID, datetime_created=timezone.now(),
+        )
+        models.ArchivedOrderItem.objects.create(id=1, order=order, product=product, quantity=1, unit_price=5)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.delete(reverse('product-detail', args=[product.pk]))
+        self.assertIn('error', response.json())
+        self.assertTrue(models.Product.objects.filter(pk=product.pk).exists())
+
+
+class BulkEditTests(TestCase):
+    def setUp(self):
+        category = models.Category.objects.create(title='Tea')
+        self.product = models.Product.objects.create(
+            name='Black tea', description='', category=category, unit_price=9000, slug='black-tea', inventory=10,
+        )
+
+    def test_price_overflow_is_rejected_before_any_batch(self):
+        serializer = serializers.ProductBulkEditSerializer(data={
+            'products': [self.product.pk], 'unit_price': {'mode': bulk_edit.MODE_PERCENT, 'value': '20'},
+        })
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('unit_price', serializer.errors)
+
+        serializer = serializers.ProductBulkEditSerializer(data={
+            'products': [self.product.pk], 'unit_price': {'mode': bulk_edit.MODE_PERCENT, 'value': '10'},
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_unknown_ids_are_not_counted_or_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            updated = bulk_edit.adjust([self.product.pk, 999999], {'inventory': (bulk_edit.MODE_ABSOLUTE, 5)})
+        self.assertEqual(updated, 1)
+        self.assertEqual(list(models.CatalogChange.objects.values_list('object_id', flat=True)), [self.product.pk])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 15)
+
+
+class ShardedInventoryTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = models.Category.objects.create(title='Tea')
+        self.product = models.Product.objects.create(
+            name='Black tea', description='', category=category, unit_price=5, slug='black-tea',
+            inventory=4, inventory_shard_count=2,
+        )
+        models.InventoryShard.objects.bulk_create([
+            models.InventoryShard(product=self.product, shard=shard, count=3) for shard in range(2)
+        ])
+
+    def stock(self):
+        product = models.Product.objects.get(pk=self.product.pk)
+        return inventory.load_stock([product])[0].stock
+
+    def checkout(self, quantity):
+        cart = models.Cart.objects.create()
+        models.CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer = serializers.OrderCreateSerializer(data={'cart_id': cart.id}, context={'user_id': self.admin.pk})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+    def test_checkout_announces_only_selling_out(self):
+        version = response_cache.get_version()
+        modified = self.product.datetime_modified
+
+        self.checkout(2)
+        self.assertEqual(self.stock(), 8)
+        self.assertEqual(response_cache.get_version(), version)
+        self.assertFalse(models.CatalogChange.objects.exists())
+        self.assertEqual(models.Product.objects.get(pk=self.product.pk).datetime_modified, modified)
+
+        self.checkout(8)
+        self.assertEqual(self.stock(), 0)
+        self.assertNotEqual(response_cache.get_version(), version)
+        self.assertIn((changes.PRODUCT, self.product.pk), models.CatalogChange.objects.values_list('kind', 'object_id'))
+        self.assertGreater(models.Product.objects.get(pk=self.product.pk).datetime_modified, modified)
+
+    def test_setting_inventory_replaces_counter_rows(self):
+        bulk_edit.adjust([self.product.pk], {'inventory': (bulk_edit.MODE_SET, 7)})
+        self.assertEqual(self.stock(), 7)
+        bulk_edit.adjust([self.product.pk], {'inventory': (bulk_edit.MODE_PERCENT, 100)})
+        self.assertEqual(self.stock(), 14)
+        bulk_edit.apply_price_list({self.product.pk: {'inventory': 5}})
+        self.assertEqual(self.stock(), 5)
+
+    def test_admin_clear_inventory_clears_counter_rows(self):
+        self.client.force_login(self.admin)
+        self.client.post(reverse('admin:store_product_changelist'), {
+            'action': 'clear_inventory', '_selected_action': [self.product.pk],
+        })
+        self.assertEqual(self.stock(), 0)
+
+
+class BrowserMiddlewareTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def test_admin_login_without_csrf_token_is_rejected(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.post(reverse('admin:login'), {'username': 'admin', 'password': 'password'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_admin_messages(self):
+        category = models.Category.objects.create(title='Tea')
+        product = models.Product.objects.create(
+            name='Black tea', description='', category=category, unit_price=5, slug='black-tea', inventory=10,
+        )
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:store_product_changelist'), {
+            'action': 'clear_inventory', '_selected_action': [product.pk],
+        }, follow=True)
+        self.assertEqual(
+            [str(message) for message in get_messages(response.wsgi_request)],
+            ['1 of products inventories cleaned to zero'],
+        )
+
+    def test_api_sets_no_session_or_csrf_cookies(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.admin)
+        headers = {'Authorization': f'JWT {AccessToken.for_user(self.admin)}'}
+
+        # the browsable API asks for a CSRF token while rendering
+        response = client.get(reverse('product-list'), headers={**headers, 'Accept': 'text/html'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+        # unsafe methods are not CSRF checked either, JWT is not sent automatically by browsers
+        response = client.post(reverse('carts-list'), {'created_at': timezone.now().isoformat()}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = models.Category.objects.create(title='Tea')
+        self.products = [
+            models.Product.objects.create(
+                name=name, description='', category=category, unit_price=price, slug=name, inventory=10,
+            ) for name, price in (('black', 5), ('green', 7))
+        ]
+
+    def test_checkout_stores_totals_without_applying_discounts(self):
+        discount = models.Discount.objects.create(discount=0.5, description='half')
+        self.products[0].discount.add(discount)
+        cart = models.Cart.objects.create()
+        models.CartItem.objects.create(cart=cart, product=self.products[0], quantity=2)
+        models.CartItem.objects.create(cart=cart, product=self.products[1], quantity=1)
+
+        serializer = serializers.OrderCreateSerializer(data={'cart_id': cart.id}, context={'user_id': self.admin.pk})
+        serializer.is_valid(raise_exception=True)
+        order = models.Order.objects.get(pk=serializer.save().pk)
+        self.assertEqual((order.item_count, order.subtotal, order.discount, order.total), (3, 17, 0, 17))
+
+    def test_admin_lists_stored_item_count(self):
+        order = models.Order.objects.create(customer=self.admin.customer)
+        models.OrderItem.objects.bulk_create([
+            models.OrderItem(order=order, product=product, quantity=3, unit_price=product.unit_price) for product in self.products
+        ])
+        order.update_totals()
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:store_order_changelist'))
+        self.assertNotIn('items', response.context['cl'].result_list._prefetch_related_lookups)
+        self.assertEqual(response.context['cl'].result_list[0].item_count, 6)
+        self.assertContains(response, 'column-item_count')
+
+
+class CustomerStatsTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = models.Category.objects.create(title='Tea')
+        self.product = models.Product.objects.create(
+            name='Black tea', description='', category=category, unit_price=5, slug='black-tea', inventory=10,
+        )
+
+    def checkout(self, quantity):
+        cart = models.Cart.objects.create()
+        models.CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        serializer = serializers.OrderCreateSerializer(data={'cart_id': cart.id}, context={'user_id': self.user.pk})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def stats(self):
+        stats = models.CustomerStats.objects.get(customer=self.user.customer)
+        return stats.order_count, stats.lifetime_spend
+
+    def test_checkout_pay_and_cancel(self):
+        first = self.checkout(2)
+        second = self.checkout(1)
+        self.assertEqual(self.stats(), (2, 0))
+        self.assertEqual(models.CustomerStats.objects.get(customer=self.user.customer).last_order_at, second.datetime_created)
+
+        first.status = models.Order.ORDER_STATUS_PAID
+        first.save()
+        self.assertEqual(self.stats(), (2, 10))
+
+        first.status = models.Order.ORDER_STATUS_CANCELED
+        first.save()
+        self.assertEqual(self.stats(), (1, 0))
+
+        models.Order.objects.bulk_transition({second.pk: models.Order.ORDER_STATUS_PAID})
+        self.assertEqual(self.stats(), (1, 5))
+
+    def test_order_created_outside_checkout_can_be_canceled(self):
+        order = models.Order.objects.create(customer=self.user.customer)
+        self.assertEqual(self.stats(), (1, 0))
+        results = models.Order.objects.bulk_transition({order.pk: models.Order.ORDER_STATUS_CANCELED})
+        self.assertIsNone(results[order.pk]['error'])
+        self.assertEqual(self.stats(), (0, 0))
+
+    def test_item_edits_move_the_spend_of_paid_orders(self):
+        order = self.checkout(2)
+        order.status = models.Order.ORDER_STATUS_PAID
+        order.save()
+        extra = models.Product.objects.create(
+            name='Green tea', description='', category=self.product.category, unit_price=5, slug='green-tea', inventory=10,
+        )
+        models.OrderItem.objects.create(order=order, product=extra, quantity=1, unit_price=5)
+        order.update_totals()
+        self.assertEqual(self.stats(), (1, 15))
+
+        unpaid = self.checkout(1)
+        models.OrderItem.objects.create(order=unpaid, product=extra, quantity=1, unit_price=5)
+        unpaid.update_totals()
+        self.assertEqual(self.stats(), (2, 15))
+
+    def test_rebuild(self):
+        order = self.checkout(3)
+        order.status = models.Order.ORDER_STATUS_PAID
+        order.save()
+        models.CustomerStats.objects.update(order_count=40, lifetime_spend=7)
+        other = get_user_model().objects.create_user('browser', 'browser@example.com', 'password')
+
+        self.assertEqual(customer_stats.rebuild([self.user.customer.pk, other.customer.pk]), 1)
+        self.assertEqual(self.stats(), (1, 15))
+        self.assertEqual(models.CustomerStats.objects.get(customer=other.customer).order_count, 0)
+
+
+class QueryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        # a round number, its Decimal filter value normalizes to 5E+1
+        self.category = models.Category.objects.create(id=50, title='Tea')
+
+    def add_product(self, name):
+        return models.Product.objects.create(
+            name=name, description='', category=self.category, unit_price=5, slug=name, inventory=10,
+        )
+
+    def listed(self):
+        response = self.client.get(reverse('product-list'), {'category_id': self.category.pk})
+        return [product['name'] for product in response.json()['results']]
+
+    def test_category_listing_is_invalidated_after_commit(self):
+        self.add_product('black')
+        self.assertEqual(self.listed(), ['black'])
+
+        generation = query_cache.get_generation(query_cache.category_generation_key(50))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_product('green')
+            self.assertEqual(query_cache.get_generation(query_cache.category_generation_key(50)), generation)
+        self.assertCountEqual(self.listed(), ['black', 'green'])
+
+
+class AsyncMiddlewareTests(TestCase):
+    def test_middleware_follows_an_async_handler(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        for path in settings.MIDDLEWARE:
+            if path.startswith('store.'):
+                instance = getattr(middleware, path.rsplit('.', 1)[1])(get_response)
+                self.assertTrue(iscoroutinefunction(instance), path)
+
+    async def test_async_views_through_the_chain(self):
+        await models.Category.objects.acreate(title='Tea')
+        response = await AsyncClient().get(reverse('async_category_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+
+class JSONRenderingTests(SimpleTestCase):
+    data = {
+        'price': Decimal('12.50'),
+        'created': datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=dt_timezone.utc),
+        'id': uuid.UUID(int=5),
+        'errors': {'name': [ErrorDetail('This field is required.', code='required')]},
+        'label': gettext_lazy('Paid'),
+        'text': 'line\u2028separator',
+    }
+    expected = {
+        'price': 12.5,
+        'created': '2024-01-02T03:04:05.123456Z',
+        'id': '00000000-0000-0000-0000-000000000005',
+        'errors': {'name': ['This field is required.']},
+        'label': 'Paid',
+        'text': 'line\u2028separator',
+    }
+
+    def test_matches_the_stdlib_renderer(self):
+        rendered = renderers.FastJSONRenderer().render(self.data)
+        self.assertEqual(json.loads(rendered), self.expected)
+        self.assertEqual(json.loads(rendered), json.loads(JSONRenderer().render(self.data)))
+        self.assertNotIn(b'\xe2\x80\xa8', rendered)
+        self.assertEqual(renderers.FastJSONRenderer().render(None), b'')
+
+    def test_indent(self):
+        rendered = renderers.FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(json.loads(rendered), {'a': 1})
+        self.assertIn(b'\n  "a"', rendered)
+
+    def test_ndjson(self):
+        renderer = renderers.NDJSONRenderer()
+        page = {'count': 2, 'next': None, 'results': [{'price': Decimal('1.50')}, {'price': Decimal('2')}]}
+        self.assertEqual([json.loads(line) for line in renderer.render(page).splitlines()], [{'price': 1.5}, {'price': 2}])
+        self.assertEqual(renderer.render({'id': 1}), b'{"id":1}\n')
+        self.assertEqual(renderer.render(None), b'')
+
+    def test_parser(self):
+        parser = parsers.FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO(b'{"price": 1.5, "ids": [1, 2]}')), {'price': 1.5, 'ids': [1, 2]})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{"price": '))
+
+    def test_stdlib_fallback_without_msgspec(self):
+        with mock.patch.object(renderers, 'msgspec', None), mock.patch.object(parsers, 'msgspec', None):
+            self.assertEqual(json.loads(renderers.FastJSONRenderer().render(self.data)), self.expected)
+            self.assertEqual(renderers.NDJSONRenderer().render([{'a': 1}, {'b': 2}]).splitlines(), [b'{"a":1}', b'{"b":2}'])
+            self.assertEqual(parsers.FastJSONParser().parse(io.BytesIO(b'{"a": [1]}')), {'a': [1]})
+            with self.assertRaises(ParseError):
+                parsers.FastJSONParser().parse(io.BytesIO(b'['))
+
+
+class JSONErrorResponseTests(TestCase):
+    def test_validation_errors_render(self):
+        response = APIClient().post(reverse('carts-list'), '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'created_at': ['This field is required.']})
+
+    def test_malformed_body(self):
+        response = APIClient().post(reverse('carts-list'), '{"created_at": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()['detail'].startswith('JSON parse error'))
+
+
+class CheckoutMixin:
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = models.Category.objects.create(title='Tea')
+        self.product = models.Product.objects.create(
+            name='Black tea', description='', category=category, unit_price=5, slug='black-tea', inventory=10,
+        )
+        self.cart = self.new_cart()
+
+    def new_cart(self):
+        cart = models.Cart.objects.create()
+        models.CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        return cart
+
+    def checkout(self, cart, key='order-1'):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post(reverse('order-list'), {'cart_id': str(cart.id)}, format='json', headers={idempotency.IDEMPOTENCY_HEADER: key})
+
+
+class IdempotentCheckoutTests(CheckoutMixin, TestCase):
+    def test_retry_replays_the_stored_response(self):
+        first = self.checkout(self.cart)
+        self.assertEqual(first.status_code, 200)
+        retry = self.checkout(self.cart)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_key_reused_for_another_request(self):
+        self.assertEqual(self.checkout(self.cart).status_code, 200)
+        response = self.checkout(self.new_cart())
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(models.Order.objects.count(), 1)
+
+
+class ConcurrentCheckoutTests(CheckoutMixin, TransactionTestCase):
+    def setUp(self):
+        # the test database name is only known once it exists
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('shared in-memory SQLite fails concurrent writers instead of blocking them')
+        super().setUp()
+
+    def test_concurrent_duplicate_waits_for_the_first_attempt(self):
+        claimed = threading.Event()
+        save = serializers.OrderCreateSerializer.save
+
+        def slow_save(serializer, **kwargs):
+            claimed.set()
+            time.sleep(0.5)
+            return save(serializer, **kwargs)
+
+        responses = {}
+
+        def first():
+            responses['first'] = self.checkout(self.cart)
+
+        with mock.patch.object(serializers.OrderCreateSerializer, 'save', slow_save):
+            thread = threading.Thread(target=first)
+            thread.start()
+            self.assertTrue(claimed.wait(5))
+            responses['second'] = self.checkout(self.cart)
+            thread.join()
+
+        self.assertEqual(responses['first'].status_code, 200)
+        self.assertEqual(responses['second'].status_code, 200)
+        self.assertEqual(responses['second']['Idempotent-Replayed'], 'true')
+        self.assertEqual(responses['second'].json(), responses['first'].json())
+        self.assertEqual(models.Order.objects.count(), 1)
+
+
+class OrderStatusUpdateTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def patch(self, order, status):
+        return self.client.patch(reverse('order-detail', args=[order.pk]), {'status': status}, format='json')
+
+    def test_patch_follows_the_transition_table(self):
+        order = models.Order.objects.create(customer=self.admin.customer)
+        response = self.patch(order, models.Order.ORDER_STATUS_PAID)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': models.Order.ORDER_STATUS_PAID})
+
+        self.assertEqual(self.patch(order, models.Order.ORDER_STATUS_UNPAID).status_code, 400)
+        self.assertEqual(self.patch(order, models.Order.ORDER_STATUS_CANCELED).status_code, 200)
+        response = self.patch(order, models.Order.ORDER_STATUS_PAID)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.json())
+        order.refresh_from_db()
+        self.assertEqual(order.status, models.Order.ORDER_STATUS_CANCELED)
+
+    def test_unknown_status(self):
+        order = models.Order.objects.create(customer=self.admin.customer)
+        self.assertEqual(self.patch(order, 'x').status_code, 400)
+
+
+class UserImportTests(TestCase):
+    def test_duplicates_differing_in_case_are_skipped(self):
+        get_user_model().objects.create_user('Alice', 'alice@example.com', 'password')
+        rows = [
+            {'username': 'alice', 'email': 'other@example.com'},
+            {'username': 'bob', 'email': 'ALICE@EXAMPLE.COM'},
+            {'username': 'Carol', 'email': 'Carol@Example.COM', 'password': 'secret'},
+            {'username': 'CAROL', 'email': 'carol2@example.com'},
+            {'username': 'dave', 'email': 'carol@example.com'},
+            {'username': 'erin'},
+        ]
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            self.assertEqual(user_import.import_batch(rows, pool), {'created': 1, 'existing': 4, 'invalid': 1})
+
+        carol = get_user_model().objects.get(username='Carol')
+        self.assertEqual(carol.email, 'Carol@example.com')
+        self.assertTrue(carol.check_password('secret'))
+        self.assertTrue(models.Customer.objects.filter(user=carol).exists())
+
+
+class MailQueueTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.buyer = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'password')
+        get_user_model().objects.create_user('nomail', '', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def send_queued_emails(self):
+        out = io.StringIO()
+        call_command('send_queued_emails', rate=1000, stdout=out)
+        return out.getvalue()
+
+    def test_queued_mail_is_sent_by_the_command(self):
+        response = self.client.post(
+            reverse('customer-send-private-email', args=[self.buyer.customer.pk]), {'subject': 'Hi', 'body': 'Private'}, format='json',
+        )
+        self.assertEqual(response.status_code, 202)
+        response = self.client.post(reverse('customer-send-bulk-email'), {'subject': 'News', 'body': 'Bulk'}, format='json')
+        self.assertEqual(response.json(), {'queued': 2})
+        self.assertEqual(len(outbox.outbox), 0)
+        self.assertEqual(models.QueuedEmail.objects.filter(status=models.QueuedEmail.EMAIL_STATUS_PENDING).count(), 3)
+
+        self.assertIn('Done: 3 sent, 0 failed', self.send_queued_emails())
+        self.assertEqual(
+            sorted((message.subject, message.to[0]) for message in outbox.outbox),
+            [('Hi', 'buyer@example.com'), ('News', 'admin@example.com'), ('News', 'buyer@example.com')],
+        )
+        for queued in models.QueuedEmail.objects.all():
+            self.assertEqual((queued.status, queued.attempts), (models.QueuedEmail.EMAIL_STATUS_SENT, 1))
+            self.assertIsNotNone(queued.datetime_sent)
+
+        self.assertIn('Done: 0 sent, 0 failed', self.send_queued_emails())
+        self.assertEqual(len(outbox.outbox), 3)
+
+    @override_settings(MAIL_QUEUE_MAX_ATTEMPTS=2)
+    def test_failed_sends_are_retried_later_then_given_up(self):
+        queued = mail.enqueue('buyer@example.com', 'Hi', 'Private')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=ConnectionError('refused')):
+            self.assertIn('Done: 0 sent, 1 failed', self.send_queued_emails())
+            queued.refresh_from_db()
+            self.assertEqual((queued.status, queued.attempts), (models.QueuedEmail.EMAIL_STATUS_PENDING, 1))
+            self.assertEqual(queued.last_error, 'ConnectionError: refused')
+            self.assertGreater(queued.send_after, timezone.now())
+            # not due yet, the lease and the retry delay keep it from being claimed again
+            self.assertIn('Done: 0 sent, 0 failed', self.send_queued_emails())
+
+            models.QueuedEmail.objects.update(send_after=timezone.now())
+            self.assertIn('Done: 0 sent, 1 failed', self.send_queued_emails())
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (models.QueuedEmail.EMAIL_STATUS_FAILED, 2))
+        self.assertEqual(len(outbox.outbox), 0)
+
+    def test_claim_leases_messages(self):
+        mail.enqueue_many(['a@example.com', 'b@example.com'], 'News', 'Bulk')
+        claimed = mail.claim(1)
+        self.assertEqual(len(claimed), 1)
+        self.assertGreater(models.QueuedEmail.objects.get(pk=claimed[0].pk).send_after, timezone.now())
+        self.assertEqual([message.to for message in mail.claim(10)], ['b@example.com'])
+        self.assertEqual(mail.claim(10), [])
+
+
+class LazyLinesSerializer(loaders.BatchLoadingMixin, drf_serializers.ModelSerializer):
+    class Meta:
+        model = models.Order
+        fields = ['id', 'lines']
+        list_serializer_class = loaders.BatchLoadingListSerializer
+
+    lines = drf_serializers.SerializerMethodField()
+
+    def get_lines(self, order):
+        return order.items.count()
+
+
+class RelationLoaderTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = models.Category.objects.create(title='Tea')
+        self.products = [
+            models.Product.objects.create(
+                name=f'Tea {i}', description='', category=category, unit_price=5, slug=f'tea-{i}', inventory=10,
+            )
+            for i in range(2)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = models.Order.objects.create(customer=self.admin.customer)
+            models.OrderItem.objects.bulk_create([
+                models.OrderItem(order=order, product=product, quantity=1, unit_price=product.unit_price) for product in self.products
+            ])
+
+    @override_settings(RELATION_LOADER_STRICT=True)
+    def test_strict_mode_raises_on_lazy_per_row_queries(self):
+        self.create_orders(2)
+        with self.assertRaises(loaders.PerRowQueryError):
+            LazyLinesSerializer(models.Order.objects.all(), many=True).data
+        with self.assertRaises(loaders.PerRowQueryError):
+            LazyLinesSerializer(models.Order.objects.first()).data
+
+    @override_settings(RELATION_LOADER_STRICT=False)
+    def test_lazy_queries_run_outside_strict_mode(self):
+        self.create_orders(2)
+        self.assertEqual([row['lines'] for row in LazyLinesSerializer(models.Order.objects.all(), many=True).data], [2, 2])
+
+    @override_settings(RELATION_LOADER_STRICT=True)
+    def test_nested_relations_are_batch_loaded(self):
+        self.create_orders(3)
+        with self.assertNumQueries(5):
+            data = serializers.OrderForAdminSerializer(models.Order.objects.all(), many=True).data
+        self.assertEqual([len(row['items']) for row in data], [2, 2, 2])
+        self.assertEqual(data[0]['customer']['email'], 'admin@example.com')
+
+    @override_settings(RELATION_LOADER_STRICT=True)
+    def test_order_list_query_count_does_not_grow_with_the_page(self):
+        self.create_orders(1)
+        with CaptureQueriesContext(connection) as one_order:
+            response = self.client.get(reverse('order-list'))
+        self.assertEqual(response.status_code, 200)
+
+        self.create_orders(4)
+        with self.assertNumQueries(len(one_order)):
+            response = self.client.get(reverse('order-list'))
+        self.assertEqual(len(response.json()['results']), 5)
+
+
+@override_settings(PROFILE_SAMPLE_INTERVAL=0.001, PROFILE_FLUSH_REQUESTS=1000)
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(profiling._aggregates, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.request = RequestFactory().get('/store/products/')
+
+    def slow_view(self, request):
+        time.sleep(0.05)
+        return HttpResponse('ok')
+
+    def aggregate(self):
+        return profiling.get_aggregate('unresolved')
+
+    @override_settings(PROFILE_MODE=profiling.MODE_SAMPLE)
+    def test_sample_mode_records_collapsed_stacks(self):
+        response = profiling.profile(self.request, self.slow_view)
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(self.aggregate().requests, 1)
+        self.assertIsNone(self.aggregate().stats)
+        self.assertTrue(any('tests.py:ProfilingTests.slow_view' in stack for stack in self.aggregate().stacks))
+
+    @override_settings(PROFILE_MODE=profiling.MODE_CPROFILE)
+    def test_cprofile_mode_records_pstats(self):
+        response = profiling.profile(self.request, self.slow_view)
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(self.aggregate().requests, 1)
+        self.assertFalse(self.aggregate().stacks)
+        self.assertTrue(any(name == 'slow_view' for _, _, name in self.aggregate().stats.stats))
+
+    @override_settings(PROFILE_MODE=profiling.MODE_CPROFILE)
+    def test_concurrent_cprofile_requests_fall_back_to_sampling(self):
+        responses = []
+
+        def view(request):
+            # a second request arrives while this one holds the profiler
+            thread = threading.Thread(target=lambda: responses.append(profiling.profile(self.request, self.slow_view)))
+            thread.start()
+            thread.join()
+            return HttpResponse('outer')
+
+        self.assertEqual(profiling.profile(self.request, view).content, b'outer')
+        self.assertEqual(responses[0].content, b'ok')
+        self.assertEqual(self.aggregate().requests, 2)
+        self.assertIsNotNone(self.aggregate().stats)
+        self.assertTrue(self.aggregate().stacks)
+
+    @override_settings(PROFILE_MODE=profiling.MODE_CPROFILE)
+    def test_profiler_held_by_another_tool(self):
+        other = cProfile.Profile()
+        other.enable()
+        try:
+            response = profiling.profile(self.request, self.slow_view)
+        finally:
+            other.disable()
+        self.assertEqual(response.content, b'ok')
+        self.assertIsNone(self.aggregate().stats)
+        self.assertEqual(self.aggregate().requests, 1)
+
+    def test_sampling_rate(self):
+        profiler = middleware.SamplingProfilerMiddleware(lambda request: HttpResponse('ok'))
+        with mock.patch.object(profiling, 'profile', return_value=HttpResponse('profiled')) as profile:
+            with override_settings(PROFILE_SAMPLE_RATE=0):
+                self.assertEqual(profiler(self.request).content, b'ok')
+            with override_settings(PROFILE_SAMPLE_RATE=0.25), mock.patch('random.random', side_effect=[0.1, 0.3]):
+                self.assertEqual(profiler(self.request).content, b'profiled')
+                self.assertEqual(profiler(self.request).content, b'ok')
+            with override_settings(PROFILE_SAMPLE_RATE=1):
+                self.assertEqual(profiler(self.request).content, b'profiled')
+        self.assertEqual(profile.call_count, 2)
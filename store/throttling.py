@@ -0,0 +1,205 @@
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import SimpleRateThrottle
+
+
+# key -> theoretical arrival time, one float per client, only used with THROTTLE_STORAGE = 'memory'
+_arrival_times = {}
+_PRUNE_SIZE = 10000
+
+# the cache lock around a GCRA update, held for one read and one write
+_LOCK_TIMEOUT = 2
+_LOCK_ATTEMPTS = 20
+_LOCK_RETRY_DELAY = 0.002
+
+
+def get_storage():
+    return getattr(settings, 'THROTTLE_STORAGE', 'memory')
+
+
+def release_lease(cache, key, token, leased_at, timeout):
+    '''
+    Deletes a key taken with cache.add(key, token, timeout) unless it may have expired and been
+    taken by another request meanwhile: past half its timeout it is left to expire, and a key
+    holding another token is never deleted.
+    '''
+    if time.monotonic() - leased_at < timeout / 2 and cache.get(key) == token:
+        cache.delete(key)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    '''
+    Token bucket with `num_requests` tokens refilled over `duration`, stored as a single
+    theoretical arrival time per key (GCRA). In memory the update is a plain dict
+    assignment, so there is no lock; racing requests can at worst let one extra through.
+    With THROTTLE_STORAGE = 'cache' the shared cache is used so all workers agree, and
+    each update runs under a per-key lock taken with cache.add so workers cannot overshoot.
+    '''
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        if get_storage() != 'cache':
+            return self.update_arrival_time()
+
+        lock_key = f'{self.key}:lock'
+        token = uuid.uuid4().hex
+        for attempt in range(_LOCK_ATTEMPTS):
+            leased_at = time.monotonic()
+            if self.cache.add(lock_key, token, _LOCK_TIMEOUT):
+                break
+            time.sleep(_LOCK_RETRY_DELAY)
+        else:
+            # heavily contended key, refuse rather than update without the lock
+            self.retry_after = self.duration / self.num_requests
+            return False
+
+        try:
+            return self.update_arrival_time()
+        finally:
+            release_lease(self.cache, lock_key, token, leased_at, _LOCK_TIMEOUT)
+
+    def update_arrival_time(self):
+        self.now = self.timer()
+        interval = self.duration / self.num_requests
+        arrival_time = max(self.get_arrival_time(self.key), self.now) + interval
+
+        self.retry_after = arrival_time - self.now - self.duration
+        if self.retry_after > 0:
+            return False
+
+        self.set_arrival_time(self.key, arrival_time)
+        return True
+
+    def wait(self):
+        return max(self.retry_after, 0)
+
+    def get_arrival_time(self, key):
+        if get_storage() == 'cache':
+            return self.cache.get(key, 0)
+        return _arrival_times.get(key, 0)
+
+    def set_arrival_time(self, key, arrival_time):
+        if get_storage() == 'cache':
+            self.cache.set(key, arrival_time, self.duration)
+            return
+
+        if len(_arrival_times) > _PRUNE_SIZE:
+            for stale_key in [k for k, t in list(_arrival_times.items()) if t < self.now]:
+                _arrival_times.pop(stale_key, None)
+        _arrival_times[key] = arrival_time
+
+
+class CartThrottle(TokenBucketThrottle):
+    '''Limits cart item changes per user, or per cart for anonymous carts.'''
+    scope = 'cart'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user_{request.user.pk}'
+        elif 'cart_pk' in view.kwargs:
+            ident = f'cart_{view.kwargs["cart_pk"]}'
+        else:
+            ident = self.get_ident(request)
+
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class CheckoutThrottle(TokenBucketThrottle):
+    scope = 'checkout'
+
+    def get_cache_key(self, request, view):
+        if not (request.user and request.user.is_authenticated):
+            return None
+
+        return self.cache_format % {'scope': self.scope, 'ident': request.user.pk}
+
+
+class Overloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many requests are being processed, please try again shortly.'
+    default_code = 'overloaded'
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        # picked up by DRF's exception handler as the Retry-After header
+        self.wait = wait
+
+
+class ConcurrencyLimiter:
+    '''
+    Sheds load once more than `setting_name` requests are inside the block.
+    Counts per process in memory, or across workers through the shared cache, where each
+    request leases one of `limit` slot keys that expire after `slot_timeout` seconds so a
+    worker dying mid-request cannot hold its slot for good.
+    '''
+
+    def __init__(self, name, setting_name, default_limit, retry_after=1, slot_timeout=60):
+        self.name = name
+        self.setting_name = setting_name
+        self.default_limit = default_limit
+        self.retry_after = retry_after
+        self.slot_timeout = slot_timeout
+        self._semaphore = None
+        self._semaphore_lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return getattr(settings, self.setting_name, self.default_limit)
+
+    def get_semaphore(self):
+        if self._semaphore is None:
+            with self._semaphore_lock:
+                if self._semaphore is None:
+                    self._semaphore = threading.BoundedSemaphore(self.limit)
+        return self._semaphore
+
+    @contextmanager
+    def __call__(self):
+        if get_storage() == 'cache':
+            with self._cache_slot():
+                yield
+            return
+
+        semaphore = self.get_semaphore()
+        if not semaphore.acquire(blocking=False):
+            raise Overloaded(self.retry_after)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    @contextmanager
+    def _cache_slot(self):
+        cache = SimpleRateThrottle.cache
+        slots = list(range(self.limit))
+        # random order spreads concurrent requests over the slots instead of all trying slot 0 first
+        random.shuffle(slots)
+        token = uuid.uuid4().hex
+        for slot in slots:
+            slot_key = f'concurrency_{self.name}:{slot}'
+            leased_at = time.monotonic()
+            if cache.add(slot_key, token, self.slot_timeout):
+                break
+        else:
+            raise Overloaded(self.retry_after)
+
+        try:
+            yield
+        finally:
+            release_lease(cache, slot_key, token, leased_at, self.slot_timeout)
+
+
+checkout_limiter = ConcurrencyLimiter('checkout', 'CHECKOUT_CONCURRENCY_LIMIT', default_limit=20)
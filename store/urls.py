@@ -1,7 +1,9 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
 
 from . import views
+from . import async_views
 
 router = routers.DefaultRouter()
 
@@ -10,6 +12,7 @@ router.register('categories',views.CategoryViewSet,basename='category')
 router.register('carts',views.CartViewSet,basename='carts')
 router.register('customers',views.CustomerViewSet,basename='customer')
 router.register('orders',views.OrderViewSet,basename='order')
+router.register('changes',views.ChangeFeedViewSet,basename='change')
 
 products_router = routers.NestedDefaultRouter(router,'products',lookup='product')
 cart_items_router = routers.NestedDefaultRouter(router,'carts',lookup='cart')
@@ -19,7 +22,17 @@ cart_items_router.register('items',views.CartItemViewSet,basename='cart_items')
 
 
 
-urlpatterns = router.urls + products_router.urls + cart_items_router.urls
+async_urlpatterns = [
+    path('async/products/',async_views.product_list,name='async_product_list'),
+    path('async/products/<int:pk>/',async_views.product_detail,name='async_product_detail'),
+    path('async/products/<int:product_pk>/comments/',async_views.comment_list,name='async_product_comment_list'),
+    path('async/products/<int:product_pk>/comments/<int:pk>/',async_views.comment_detail,name='async_product_comment_detail'),
+    path('async/categories/',async_views.category_list,name='async_category_list'),
+    path('async/categories/<int:pk>/',async_views.category_detail,name='async_category_detail'),
+]
+
+
+urlpatterns = router.urls + products_router.urls + cart_items_router.urls + async_urlpatterns
 
 
 
@@ -0,0 +1,95 @@
+import csv
+import json
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils.dateparse import parse_date
+
+from . import models
+
+
+USER_FIELDS = ['username', 'email', 'first_name', 'last_name']
+
+
+def init_worker():
+    # spawned (non-forked) hashing processes start without configured apps
+    django.setup()
+
+
+def hash_password(password):
+    '''Keeps values that already are Django password hashes, hashes raw passwords, empty ones become unusable.'''
+    if password:
+        try:
+            identify_hasher(password)
+            return password
+        except ValueError:
+            pass
+    return make_password(password or None)
+
+
+def read_rows(path, file_format):
+    '''Yields one dict per CSV row or JSONL line, blank lines yield {} so row numbers stay stable.'''
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                yield json.loads(line) if line.strip() else {}
+
+
+def normalize(row):
+    '''Normalizes username and email the way create_user does.'''
+    User = get_user_model()
+    return {**row, 'username': User.normalize_username(row['username']), 'email': User.objects.normalize_email(row['email'])}
+
+
+def import_batch(rows, pool):
+    '''
+    Inserts the users of one batch and their Customer rows in one transaction and returns
+    counts by outcome. bulk_create sends no post_save, so create_customer_profile_for_newly_created_user
+    never runs and the profiles are inserted here in bulk instead. Rows whose username or
+    email already exist, compared case-insensitively, are skipped, which makes rerunning a batch harmless.
+    '''
+    User = get_user_model()
+    valid = [normalize(row) for row in rows if row.get('username') and row.get('email')]
+    taken_usernames = {
+        username.casefold() for username in User.objects.annotate(key=Lower('username'))
+        .filter(key__in={row['username'].lower() for row in valid}).values_list('username', flat=True)
+    }
+    taken_emails = {
+        email.casefold() for email in User.objects.annotate(key=Lower('email'))
+        .filter(key__in={row['email'].lower() for row in valid}).values_list('email', flat=True)
+    }
+
+    new_rows = []
+    for row in valid:
+        username, email = row['username'].casefold(), row['email'].casefold()
+        if username in taken_usernames or email in taken_emails:
+            continue
+        taken_usernames.add(username)
+        taken_emails.add(email)
+        new_rows.append(row)
+
+    passwords = pool.map(hash_password, [row.get('password') for row in new_rows], chunksize=max(len(new_rows) // 32, 1))
+    users = [
+        User(password=password, **{field: row.get(field) or '' for field in USER_FIELDS})
+        for row, password in zip(new_rows, passwords)
+    ]
+
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        # MySQL does not return the new primary keys
+        user_ids = dict(User.objects.filter(username__in=[user.username for user in users]).values_list('username', 'id'))
+        models.Customer.objects.bulk_create([
+            models.Customer(
+                user_id=user_ids[row['username']],
+                phone_number=row.get('phone_number') or '',
+                birth_date=parse_date(row['birth_date']) if row.get('birth_date') else None,
+            )
+            for row in new_rows
+        ])
+
+    return {'created': len(users), 'existing': len(valid) - len(users), 'invalid': len(rows) - len(valid)}
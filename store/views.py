@@ -1,32 +1,187 @@
+from decimal import Decimal
+
 from rest_framework.response import Response 
 from rest_framework import status
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, SAFE_METHODS
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.mixins import RetrieveModelMixin, CreateModelMixin, DestroyModelMixin
 from rest_framework.decorators import action
-from django_filters.rest_framework import OrderingFilter, DjangoFilterBackend
+from rest_framework.exceptions import ValidationError
+from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
+from django.http import Http404
+from django.db import transaction
 from django.db.models import Prefetch
 
 from . import models 
 from . import serializers
 from . import permissions
 from . import signals
+from . import replicas
+from . import throttling
+from . import idempotency
+from . import autocomplete
+from . import response_cache
+from . import query_cache
+from . import changes
+from . import filters
+from . import archive
+from . import mail
+
+
 
+class ReplicaReadMixin:
+    '''Lets safe requests read from the replicas unless the user has just written.'''
+    
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        
+        if request.method in SAFE_METHODS and not replicas.is_pinned_to_primary(request):
+            self._replica_token = replicas.allow_replica_reads()
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            replicas.reset_replica_reads(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
 
 
-class ProductViewSet(ModelViewSet):
+
+class CachedResponseMixin:
+    '''Serves list and retrieve from the shared cache until the catalog or the rates change.'''
+    
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+    
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+    
+    def cached_response(self, handler, request, *args, **kwargs):
+        # a user pinned to the primary just wrote, cached or replica-built responses may predate it
+        if replicas.is_pinned_to_primary(request):
+            return handler(request, *args, **kwargs)
+        
+        data = response_cache.load(request)
+        if data is not None:
+            return Response(data)
+        
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response_cache.save(request, response.data)
+        return response
+
+
+
+class CachedQueryMixin:
+    '''
+    Caches the ids and count behind each list page, keyed by the normalized filter, search,
+    ordering and page parameters under the query_cache generations. A hit renders the page
+    from the object cache plus one primary key query for the objects missing there.
+    '''
+    object_cache_name = None
+    
+    def list(self, request, *args, **kwargs):
+        params = None if replicas.is_pinned_to_primary(request) else self.get_query_cache_params(request)
+        if params is None:
+            return super().list(request, *args, **kwargs)
+        
+        category_id = params['filters'].get('category_id')
+        # NumberFilter cleans to a Decimal, generations are keyed by the integer pk
+        key = query_cache.cache_key(params, None if category_id is None else int(category_id))
+        cached = query_cache.load(key)
+        if cached is not None:
+            return self.cached_page(request, cached)
+        
+        response = super().list(request, *args, **kwargs)
+        page = getattr(self.paginator, 'page', None)
+        if response.status_code == status.HTTP_200_OK and page is not None:
+            query_cache.save(key, [item.pk for item in page.object_list], page.paginator.count, page.number)
+            if self.uses_object_cache(request):
+                response_cache.save_objects(self.object_cache_name, {item['id']: item for item in response.data['results']})
+        return response
+    
+    def get_query_cache_params(self, request):
+        '''None when the parameters do not validate, the uncached path then reports the errors.'''
+        if self.paginator is None:
+            return None
+        queryset = self.get_queryset()
+        filterset = DjangoFilterBackend().get_filterset(request, queryset, self)
+        if filterset is not None and not filterset.is_valid():
+            return None
+        
+        filters = {}
+        if filterset is not None:
+            filters = {
+                name: value.normalize() if isinstance(value, Decimal) else value
+                for name, value in filterset.form.cleaned_data.items() if value not in (None, '')
+            }
+        return {
+            'filters': filters,
+            'search': sorted({term.lower() for term in SearchFilter().get_search_terms(request)}),
+            'ordering': OrderingFilter().get_ordering(request, queryset, self),
+            'page': request.query_params.get(self.paginator.page_query_param, '1'),
+            'page_size': self.paginator.get_page_size(request),
+        }
+    
+    def cached_page(self, request, cached):
+        found = self.get_representations(cached['ids'], self.uses_object_cache(request))
+        
+        # a stand-in paginator over the cached count gives the same next and previous links
+        page_size = self.paginator.get_page_size(request)
+        self.paginator.page = self.paginator.django_paginator_class(range(cached['count']), page_size).page(cached['number'])
+        self.paginator.request = request
+        return self.paginator.get_paginated_response([found[object_id] for object_id in cached['ids'] if object_id in found])
+    
+    def uses_object_cache(self, request):
+        # the object cache holds full representations only
+        return self.object_cache_name is not None and not ({'fields', 'expand'} & set(request.query_params))
+    
+    def get_representations(self, ids, use_cache):
+        '''{id: data} for the ids that exist, cached ones first, the rest from one id__in query.'''
+        found = response_cache.load_objects(self.object_cache_name, ids) if use_cache else {}
+        misses = [object_id for object_id in ids if object_id not in found]
+        if misses:
+            objects = list(self.get_queryset().filter(pk__in=misses))
+            # keyed by pk, ?fields= may leave id out of the data
+            fetched = dict(zip((obj.pk for obj in objects), self.get_serializer(objects, many=True).data))
+            if use_cache:
+                response_cache.save_objects(self.object_cache_name, fetched)
+            found.update(fetched)
+        return found
+
+
+
+class SparseFieldsMixin:
+    '''Narrows the queryset to what ?fields= and ?expand= ask the serializer for.'''
+    
+    def get_queryset(self):
+        return self.optimize_queryset(super().get_queryset())
+    
+    def optimize_queryset(self, queryset):
+        serializer_class = self.get_serializer_class()
+        if self.request.method in SAFE_METHODS and hasattr(serializer_class, 'optimize_queryset'):
+            return serializer_class.optimize_queryset(queryset, self.request)
+        return queryset
+
+
+
+class ProductViewSet(CachedResponseMixin,CachedQueryMixin,ReplicaReadMixin,SparseFieldsMixin,ModelViewSet):
     serializer_class = serializers.ProductSerializer
     queryset = models.Product.objects.select_related('category').all()
     filter_backends = [DjangoFilterBackend,OrderingFilter,SearchFilter]
     ordering_fields = ['name','price','inventory']
-    search_fields = ['title','category__title']
+    search_fields = ['name','category__title']
+    filterset_class = filters.ProductFilter
     pagination_class = PageNumberPagination
+    object_cache_name = 'product'
     
     permission_classes = [permissions.CustomDjangoModelPermissions]
     
+    MAX_BATCH_SIZE = 100
+    
     def get_serializer_context(self):
         return {'request': self.request}
     
@@ -34,14 +189,101 @@ class ProductViewSet(ModelViewSet):
     def destroy(self,request,pk):
         product = get_object_or_404(models.Product.objects.select_related('category'),pk=pk)
         
-        if product.order_items.count() > 0:
+        # archived items PROTECT the product as well
+        if product.order_items.count() > 0 or product.archived_order_items.exists():
             return Response({'error':'Ther is some order items including the products . please remove them first.'})
         product.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
     
+    
+    @action(detail=False)
+    def batch(self,request):
+        '''
+        ?ids=3,1,2 returns those products in request order plus the ids that do not exist.
+        Cached products are served first, the rest come from one id__in query.
+        '''
+        try:
+            ids = list(dict.fromkeys(
+                int(product_id) for value in request.query_params.getlist('ids') for product_id in value.split(',') if product_id
+            ))
+        except ValueError:
+            raise ValidationError({'ids':'ids must be a comma separated list of integers.'})
+        if len(ids) > self.MAX_BATCH_SIZE:
+            raise ValidationError({'ids':f'At most {self.MAX_BATCH_SIZE} ids can be requested at once.'})
+        
+        found = self.get_representations(ids,self.uses_object_cache(request))
+        return Response({
+            'results': [found[product_id] for product_id in ids if product_id in found],
+            'missing': [product_id for product_id in ids if product_id not in found],
+        })
+    
+    
+    @action(detail=False,methods=['POST'],permission_classes=[IsAdminUser])
+    def bulk_edit(self,request):
+        serializer = serializers.ProductBulkEditSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'updated': serializer.save()})
+    
+    
+    @action(detail=False)
+    def autocomplete(self,request):
+        '''Prefix matches on product names and category titles from the in-process index, ?q=...&limit=...'''
+        query = request.query_params.get('q','')
+        try:
+            limit = min(max(int(request.query_params.get('limit',10)),1),autocomplete.MAX_LIMIT)
+        except ValueError:
+            limit = 10
+        return Response(autocomplete.get_index().search(query,limit))
+    
+    
+    @action(detail=True)
+    def recommendations(self,request,pk):
+        '''Frequently bought together, precomputed by the build_recommendations command.'''
+        queryset = models.ProductRecommendation.objects.filter(product_id=pk).select_related('recommended').order_by('rank')
+        serializer = serializers.ProductRecommendationSerializer(queryset,many=True)
+        return Response(serializer.data)
 
 
-class CategoryViewSet(ModelViewSet):
+
+class ChangeFeedViewSet(GenericViewSet):
+    '''
+    Catalog changes after ?after=<cursor>: current state of changed products and categories plus
+    the ids of deleted ones. Without ?after= only the current cursor is returned, take it before a
+    full download and follow the feed from there.
+    '''
+    queryset = models.CatalogChange.objects.all()
+    permission_classes = [permissions.CustomDjangoModelPermissions]
+    
+    MAX_LIMIT = 1000
+    
+    def list(self,request):
+        if 'after' not in request.query_params:
+            return Response({'cursor':changes.latest_cursor(),'has_more':False})
+        
+        try:
+            after = int(request.query_params['after'])
+            limit = min(int(request.query_params.get('limit',self.MAX_LIMIT)),self.MAX_LIMIT)
+        except ValueError:
+            raise ValidationError({'after':'after and limit must be integers.'})
+        
+        changed, cursor, has_more = changes.read(after,max(limit,1))
+        products = list(changes.current_products(changed[changes.PRODUCT]))
+        categories = list(changes.current_categories(changed[changes.CATEGORY]))
+        
+        return Response({
+            'cursor': cursor,
+            'has_more': has_more,
+            'products': serializers.ProductSerializer(products,many=True,context={'request':request}).data,
+            'categories': serializers.AnnotatedCategorySerializer(categories,many=True).data,
+            'deleted': {
+                'products': sorted(changed[changes.PRODUCT] - {product.id for product in products}),
+                'categories': sorted(changed[changes.CATEGORY] - {category.id for category in categories}),
+            },
+        })
+
+
+
+class CategoryViewSet(CachedResponseMixin,ReplicaReadMixin,ModelViewSet):
     serializer_class = serializers.CategorySerializer
     queryset = models.Category.objects.prefetch_related('products').all()
     
@@ -57,7 +299,7 @@ class CategoryViewSet(ModelViewSet):
 
 
 
-class CommentViewSet(ModelViewSet):
+class CommentViewSet(ReplicaReadMixin,ModelViewSet):
     serializer_class = serializers.CommentSerializer
     queryset = models.Comment.objects.all()
     
@@ -82,6 +324,7 @@ class CartViewSet(CreateModelMixin,RetrieveModelMixin,DestroyModelMixin,GenericV
 class CartItemViewSet(ModelViewSet):
     serializer_class = serializers.CartItemSerializer
     http_method_names = ['get','post','patch','delete']
+    throttle_classes = [throttling.CartThrottle]
     
     def get_queryset(self):
         cart_pk = self.kwargs['cart_pk']
@@ -103,15 +346,18 @@ class CartItemViewSet(ModelViewSet):
 
 class CustomerViewSet(ModelViewSet):
     serializer_class = serializers.CustomerSerializer
-    queryset = models.Customer.objects.all()
+    queryset = models.Customer.objects.select_related('user','stats')
     
     permission_classes = [IsAdminUser,IsAuthenticated]
+    filter_backends = [OrderingFilter]
+    # read from the stats table, never aggregated per request
+    ordering_fields = ['id','stats__order_count','stats__lifetime_spend','stats__last_order_at']
     
     
     @action(detail=False,methods=['GET','PUT']) 
     def me(self,request):
         user_id = request.user.id
-        customer = models.Customer.objects.get(user_id=user_id)
+        customer = models.Customer.objects.select_related('user','stats').get(user_id=user_id)
         if request.method == 'GET':
             serializer = serializers.CustomerSerializer(customer) 
             return Response(serializer.data)
@@ -123,21 +369,52 @@ class CustomerViewSet(ModelViewSet):
             return Response(serializer.data)
   
   
-    @action(detail=True,permission_classes=[permissions.SendPrivateEmailToCustomerPermission])
+    @action(detail=True,methods=['POST'],permission_classes=[permissions.SendPrivateEmailToCustomerPermission])
     def send_private_email(self,request,pk):
-        return Response(f'sending email to customer {pk=}')
+        '''Queues the message for send_queued_emails instead of talking SMTP inside the request.'''
+        customer = get_object_or_404(models.Customer.objects.select_related('user'),pk=pk)
+        serializer = serializers.EmailSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not customer.email:
+            raise ValidationError({'detail':'This customer has no email address.'})
+        
+        queued = mail.enqueue(customer.email,**serializer.validated_data)
+        return Response({'queued': queued.id},status=status.HTTP_202_ACCEPTED)
+    
+    
+    @action(detail=False,methods=['POST'],permission_classes=[permissions.SendPrivateEmailToCustomerPermission])
+    def send_bulk_email(self,request):
+        '''Queues the message for every customer matching the CustomerFilter query parameters.'''
+        serializer = serializers.EmailSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        customers = filters.CustomerFilter(request.query_params,queryset=models.Customer.objects.all())
+        if not customers.is_valid():
+            raise ValidationError(customers.errors)
+        recipients = customers.qs.exclude(user__email='').order_by('id').values_list('user__email',flat=True)
+        
+        queued = mail.enqueue_many(recipients.iterator(chunk_size=mail.ENQUEUE_BATCH_SIZE),**serializer.validated_data)
+        return Response({'queued': queued},status=status.HTTP_202_ACCEPTED)
     
     
     
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(SparseFieldsMixin,ModelViewSet):
     permission_classes = [IsAuthenticated]
     http_method_names = ['get','post','patch','delete','option','head']
+    filter_backends = [OrderingFilter]
+    # stored columns, sorting never reads OrderItem
+    ordering_fields = ['datetime_created','total','item_count']
     
     def get_permissions(self):
-        if self.request.method in ['PATCH','DELETE']:
+        if self.request.method in ['PATCH','DELETE'] or self.action == 'bulk_status':
             return [IsAdminUser()]
         return [IsAuthenticated()]
     
+    def get_throttles(self):
+        if self.action == 'create':
+            return [throttling.CheckoutThrottle()]
+        return super().get_throttles()
+    
     
     def get_queryset(self):
         
@@ -148,10 +425,70 @@ class OrderViewSet(ModelViewSet):
                     )
             ).select_related('customer__user').all()
         
-        if self.request.user.is_staff:
-            return queryset 
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(customer__user_id=self.request.user.id)
+        
+        return self.optimize_queryset(queryset)
+    
+    
+    def get_archive_queryset(self):
+        queryset = archive.archived_orders()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(customer__user_id=self.request.user.id)
+        return queryset
+    
+    
+    def get_date_range(self):
+        serializer = serializers.OrderDateRangeSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+    
+    
+    def filter_dates(self,queryset,date_range):
+        if 'created_after' in date_range:
+            queryset = queryset.filter(datetime_created__gte=date_range['created_after'])
+        if 'created_before' in date_range:
+            queryset = queryset.filter(datetime_created__lt=date_range['created_before'])
+        return queryset
+    
+    
+    def filter_queryset(self,queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list':
+            queryset = self.filter_dates(queryset,self.get_date_range())
+        return queryset
+    
+    
+    def list(self,request,*args,**kwargs):
+        '''Staff listings reach into the archive only when the date range starts before the archive horizon.'''
+        date_range = self.get_date_range()
+        horizon = archive.get_horizon()
+        starts_before_horizon = (
+            date_range.get('created_after',horizon) < horizon
+            or date_range.get('created_before',horizon) < horizon
+        )
+        if not (request.user.is_staff and starts_before_horizon):
+            return super().list(request,*args,**kwargs)
         
-        return queryset.filter(customer__user_id=self.request.user.id)
+        # the archive has the same total columns, so ?ordering= works across the union too
+        ordering = OrderingFilter().get_ordering(request,models.Order.objects.all(),self) or []
+        columns = list(dict.fromkeys(field.lstrip('-') for field in ordering))
+        live_ids = self.filter_dates(models.Order.objects.all(),date_range).values_list('id',*columns)
+        archived_ids = self.filter_dates(models.ArchivedOrder.objects.all(),date_range).values_list('id',*columns)
+        page_ids = [row[0] for row in self.paginate_queryset(live_ids.union(archived_ids).order_by(*ordering,'-id'))]
+        
+        orders = {order.id: order for order in self.get_queryset().filter(id__in=page_ids)}
+        orders.update((order.id,order) for order in self.get_archive_queryset().filter(id__in=page_ids))
+        serializer = self.get_serializer([orders[order_id] for order_id in page_ids if order_id in orders],many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    
+    def retrieve(self,request,*args,**kwargs):
+        try:
+            return super().retrieve(request,*args,**kwargs)
+        except Http404:
+            order = get_object_or_404(self.get_archive_queryset(),pk=kwargs['pk'])
+            return Response(self.get_serializer(order).data)
         
         
     def get_serializer_class(self):
@@ -168,22 +505,45 @@ class OrderViewSet(ModelViewSet):
     
     
     def get_serializer_context(self):
-        return {'user_id': self.request.user.id}
+        return {'request': self.request, 'user_id': self.request.user.id}
     
     
     def create(self,request,*args,**kwargs):
-        create_order_serializer = serializers.OrderCreateSerializer(
-            data=request.data,
-            context = {'user_id': self.request.user.id}
-            )
-        create_order_serializer.is_valid(raise_exception=True)
-        created_order = create_order_serializer.save()
+        idempotency_key = request.headers.get(idempotency.IDEMPOTENCY_HEADER)
         
-        signals.order_ceated.send_robust(self.__class__,order=created_order)
+        with throttling.checkout_limiter(), transaction.atomic():
+            if idempotency_key:
+                record, created = idempotency.claim(request.user.id,idempotency_key,request.data)
+                if not created:
+                    return idempotency.replay(record)
+            
+            create_order_serializer = serializers.OrderCreateSerializer(
+                data=request.data,
+                context = {'user_id': self.request.user.id}
+                )
+            create_order_serializer.is_valid(raise_exception=True)
+            created_order = create_order_serializer.save()
+            
+            serializer = serializers.OrderSerializer(created_order)
+            
+            if idempotency_key:
+                idempotency.store(record,status.HTTP_200_OK,serializer.data)
         
-        serializer = serializers.OrderSerializer(created_order)
+        signals.order_ceated.send_robust(self.__class__,order=created_order)
         
         return Response(serializer.data)
     
+    
+    @action(detail=False,methods=['POST'])
+    def bulk_status(self,request):
+        serializer = serializers.OrderBulkStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+        
+        return Response({
+            'updated': sum(1 for result in results if result['error'] is None),
+            'results': results,
+        })
+    
         
     